@@ -0,0 +1,10 @@
+"""Offline speed and accuracy benchmark for the OMR pipeline
+
+Run from the backend directory:
+
+    python -m benchmark --sheets 100 --seed 1
+    python -m benchmark --database
+"""
+from .synthetic import SheetSpec, random_spec, render_form, render_sheet
+from .runner import run_benchmark, format_report
+from .database import run_database_benchmark, format_database_report
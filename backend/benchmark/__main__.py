@@ -0,0 +1,66 @@
+"""Command-line entry point: python -m benchmark"""
+import argparse
+import json
+import logging
+
+from main import PROCESSING_PROFILES
+from .database import run_database_benchmark, format_database_report
+from .runner import run_benchmark, format_report, format_latency_comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OMR pipeline on synthetic sheets")
+    parser.add_argument('--sheets', type=int, default=50, help="number of sheets to grade")
+    parser.add_argument('--seed', type=int, default=0, help="seed for sheet generation")
+    parser.add_argument('--profile', choices=sorted(PROCESSING_PROFILES), default=None,
+                        help="processing profile (default: OMR_PROFILE)")
+    parser.add_argument('--blank-rate', type=float, default=0.05, help="fraction of unanswered questions")
+    parser.add_argument('--upside-down-rate', type=float, default=0.1, help="fraction of sheets rotated 180 degrees")
+    parser.add_argument('--warmup', type=int, default=2, help="untimed sheets before the run")
+    parser.add_argument('--memory-sheets', type=int, default=5, help="sheets to trace for peak memory (0 to skip)")
+    parser.add_argument('--no-lean', action='store_true', help="keep the colour input and intermediates")
+    parser.add_argument('--parallel-columns', action='store_true',
+                        help="process the four answer columns in threads")
+    parser.add_argument('--compare-columns', action='store_true',
+                        help="run serial and column-parallel back to back and compare latency")
+    parser.add_argument('--ocr', action='store_true', help="include header OCR (needs Tesseract)")
+    parser.add_argument('--database', action='store_true',
+                        help="benchmark grading-database writes and reads instead of the pipeline")
+    parser.add_argument('--db-rows', type=int, default=2000, help="sheets written in the database benchmark")
+    parser.add_argument('--db-writers', type=int, default=4,
+                        help="threads writing sheets in the database benchmark")
+    parser.add_argument('--db-readers', type=int, default=4,
+                        help="threads reading statistics while the database benchmark writes")
+    parser.add_argument('--json', metavar='PATH', help="also write the full report as JSON")
+    args = parser.parse_args()
+
+    # The pipeline logs every stage; keep the report readable
+    logging.disable(logging.WARNING)
+
+    options = dict(
+        sheets=args.sheets, seed=args.seed, profile=args.profile,
+        blank_rate=args.blank_rate, upside_down_rate=args.upside_down_rate,
+        warmup=args.warmup, memory_sheets=args.memory_sheets, ocr=args.ocr,
+        lean=not args.no_lean
+    )
+    if args.database:
+        report = run_database_benchmark(rows=args.db_rows, writers=args.db_writers, readers=args.db_readers,
+                                        seed=args.seed)
+        print(format_database_report(report))
+    elif args.compare_columns:
+        serial = run_benchmark(parallel_columns=False, **options)
+        parallel = run_benchmark(parallel_columns=True, **options)
+        print(format_report(parallel))
+        print(format_latency_comparison(serial, parallel))
+        report = {'serial': serial, 'parallel': parallel}
+    else:
+        report = run_benchmark(parallel_columns=args.parallel_columns, **options)
+        print(format_report(report))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Grading-database benchmark: write throughput and read latency under writes
+
+Compares a plain connection per call (rollback journal, default pragmas,
+one commit per write) with the pooled WAL connections and group-commit
+writer, each on a fresh database file. Sheets are written by several
+threads at once, as concurrent /grade_student requests would.
+"""
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from main import DatabaseManager, grade_answers
+from .runner import _percentiles
+
+# name -> (pooled, durable): durable waits for each sheet's commit like
+# /grade_student does by default; without it writes are only queued
+STRATEGIES = {
+    'per_call': (False, True),
+    'group_commit': (True, True),
+    'group_commit_async': (True, False),
+}
+
+
+def _entry(i, rng, master_answers):
+    answers = {str(q): int(rng.integers(1, 5)) for q in range(1, 41) if rng.random() >= 0.05}
+    results, _ = grade_answers(answers, master_answers)
+    return f'S{i:06d}', answers, results
+
+
+def _write_sheets(db, entries, master_key_id, writers, durable):
+    """Write the sheets from `writers` threads; returns sheets per second"""
+    def write(chunk):
+        for student_id, answers, results in chunk:
+            # One write per sheet, student row and result together, as /grade_student saves it
+            db.add_grading_results_batch([{
+                'student_id': student_id, 'name': 'Student', 'subject': 'Benchmark', 'medium': 'English',
+                'grade_level': 'General', 'exam_date': '2024-01-01', 'results': results, 'answers': answers,
+                'master_key_id': master_key_id
+            }], durable=durable)
+
+    threads = [threading.Thread(target=write, args=(entries[i::writers],)) for i in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush_writes()
+    return len(entries) / (time.perf_counter() - start)
+
+
+def _run(db_path, pooled, durable, rows, writers, readers, seed):
+    db = DatabaseManager(db_path, pooled=pooled)
+    rng = np.random.default_rng(seed)
+    master_answers = {str(q): int(rng.integers(1, 5)) for q in range(1, 41)}
+    master_key_id = db.add_master_key('Benchmark', '2024-01-01', 'General', master_answers)
+    entries = [_entry(i, rng, master_answers) for i in range(rows)]
+
+    # Insert throughput alone, then again while dashboards read statistics
+    half = rows // 2
+    inserts_per_sec = _write_sheets(db, entries[:half], master_key_id, writers, durable)
+
+    latencies = []
+    failed_reads = [0]
+    lock = threading.Lock()
+    writing = threading.Event()
+    writing.set()
+
+    def read():
+        while writing.is_set():
+            begin = time.perf_counter()
+            stats = db.get_statistics()
+            elapsed = time.perf_counter() - begin
+            with lock:
+                latencies.append(elapsed)
+                failed_reads[0] += not stats
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    contended_inserts_per_sec = _write_sheets(db, entries[half:], master_key_id, writers, durable)
+    writing.clear()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'pooled': pooled,
+        'durable': durable,
+        'rows': rows,
+        'writers': writers,
+        'readers': readers,
+        'rows_saved': db.count_results(master_key_id),
+        'inserts_per_sec': round(inserts_per_sec, 1),
+        'inserts_per_sec_with_readers': round(contended_inserts_per_sec, 1),
+        'reads': len(latencies),
+        'failed_reads': failed_reads[0],
+        'read_latency': _percentiles(latencies) if latencies else None,
+    }
+
+
+def run_database_benchmark(rows=2000, writers=4, readers=4, seed=0):
+    """Run the write/read workload once per strategy in STRATEGIES"""
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (pooled, durable) in STRATEGIES.items():
+            report[name] = _run(os.path.join(tmp, f'{name}.db'), pooled, durable, rows, writers, readers, seed)
+    return report
+
+
+def format_database_report(report):
+    """Side-by-side table of a database benchmark report"""
+    names = list(report)
+    runs = [report[name] for name in names]
+    first = runs[0]
+
+    def row(label, values, fmt):
+        return f"{label:<28}" + "".join(format(value, fmt) for value in values)
+
+    lines = [
+        f"Database: {first['rows']} sheets from {first['writers']} writers, {first['readers']} concurrent readers",
+        f"{'':<28}" + "".join(f"{name:>20}" for name in names),
+        row('sheets/sec', [r['inserts_per_sec'] for r in runs], '>20.1f'),
+        row('sheets/sec with readers', [r['inserts_per_sec_with_readers'] for r in runs], '>20.1f'),
+        row('rows saved', [r['rows_saved'] for r in runs], '>20'),
+        row('reads completed', [r['reads'] for r in runs], '>20'),
+        row('failed reads', [r['failed_reads'] for r in runs], '>20'),
+    ]
+    for name in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'):
+        values = [r['read_latency'][name] if r['read_latency'] else float('nan') for r in runs]
+        lines.append(row('read ' + name, values, '>20.2f'))
+    return "\n".join(lines)
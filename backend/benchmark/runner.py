@@ -0,0 +1,129 @@
+"""Throughput, latency and accuracy benchmark for EnhancedOMRProcessor"""
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from main import EnhancedOMRProcessor, HEADER_FIELDS
+from .synthetic import random_spec, render_sheet
+
+PERCENTILES = (50, 90, 99)
+
+
+def _percentiles(samples):
+    """p50/p90/p99 and max of a list of seconds, in milliseconds"""
+    values = np.asarray(samples) * 1000.0
+    stats = {f'p{p}_ms': round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    stats['max_ms'] = round(float(values.max()), 2)
+    return stats
+
+
+def _peak_memory(specs, profile, lean):
+    """Peak Python-side allocation (numpy included) while processing the sheets"""
+    peak = 0
+    for spec in specs:
+        processor = EnhancedOMRProcessor(image=render_sheet(spec), profile=profile, ocr_fields=(),
+                                         timings=False, lean=lean, trace_memory=True)
+        processor.process()
+        peak = max(peak, processor.peak_memory)
+    return peak
+
+
+def run_benchmark(sheets=50, seed=0, profile=None, blank_rate=0.05, upside_down_rate=0.1,
+                  warmup=2, memory_sheets=5, ocr=False, lean=True, parallel_columns=False):
+    """Grade `sheets` synthetic sheets and report speed and accuracy
+
+    Rendering is excluded from the timings. OCR is off by default so the
+    numbers do not depend on whether Tesseract is installed.
+    """
+    rng = np.random.default_rng(seed)
+    specs = [random_spec(rng, blank_rate=blank_rate, upside_down_rate=upside_down_rate)
+             for _ in range(sheets)]
+    kwargs = {'profile': profile, 'ocr_fields': HEADER_FIELDS if ocr else (), 'timings': True, 'lean': lean,
+              'parallel_columns': parallel_columns}
+
+    for spec in specs[:warmup]:
+        EnhancedOMRProcessor(image=render_sheet(spec), **kwargs).process()
+
+    stage_samples = defaultdict(list)
+    question_hits = np.zeros(40, dtype=np.int64)
+    style_hits = defaultdict(lambda: [0, 0])
+    failed = escalated = 0
+    elapsed = 0.0
+
+    for spec in specs:
+        image = render_sheet(spec)
+        processor = EnhancedOMRProcessor(image=image, **kwargs)
+        start = time.perf_counter()
+        ok = processor.process()
+        elapsed += time.perf_counter() - start
+
+        if not ok:
+            failed += 1
+        escalated += processor.escalated
+        for stage, seconds in processor.timings.items():
+            stage_samples[stage].append(seconds)
+
+        # A blank question counts as correct when nothing was read for it
+        hits = np.array([processor.answers.get(str(q)) == spec.answers.get(str(q))
+                         for q in range(1, 41)])
+        question_hits += hits
+        style_hits[spec.mark_style][0] += int(hits.sum())
+        style_hits[spec.mark_style][1] += 40
+
+    per_question = question_hits / float(sheets)
+    report = {
+        'sheets': sheets,
+        'seed': seed,
+        'profile': profile,
+        'lean': lean,
+        'parallel_columns': parallel_columns,
+        'sheets_per_sec': round(sheets / elapsed, 2) if elapsed else None,
+        'failed': failed,
+        'escalated': escalated,
+        'stages': {stage: _percentiles(samples) for stage, samples in sorted(stage_samples.items())},
+        'accuracy': round(float(question_hits.sum()) / (40 * sheets), 4),
+        'accuracy_by_mark_style': {
+            style: round(hit / float(total), 4) for style, (hit, total) in sorted(style_hits.items())
+        },
+        'accuracy_by_question': {str(q + 1): round(float(per_question[q]), 4) for q in range(40)},
+    }
+    if memory_sheets:
+        report['peak_traced_bytes'] = _peak_memory(specs[:memory_sheets], profile, lean)
+    return report
+
+
+def format_report(report):
+    """Render a report as a short plain-text summary"""
+    lines = [
+        f"Sheets: {report['sheets']} (seed {report['seed']}, profile {report['profile'] or 'default'}"
+        f"{', lean' if report['lean'] else ''}{', parallel columns' if report['parallel_columns'] else ''})",
+        f"Throughput: {report['sheets_per_sec']} sheets/sec",
+        f"Failed: {report['failed']} | Escalated: {report['escalated']}",
+        f"Accuracy: {report['accuracy'] * 100:.2f}%",
+    ]
+    for style, accuracy in report['accuracy_by_mark_style'].items():
+        lines.append(f"  {style:<12} {accuracy * 100:.2f}%")
+
+    worst = sorted(report['accuracy_by_question'].items(), key=lambda item: item[1])[:5]
+    lines.append("Weakest questions: " + ", ".join(f"Q{q} {acc * 100:.0f}%" for q, acc in worst))
+
+    lines.append(f"{'Stage':<12}" + "".join(f"{name:>10}" for name in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')))
+    for stage, stats in report['stages'].items():
+        lines.append(f"{stage:<12}" + "".join(f"{stats[name]:>10.2f}" for name in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')))
+
+    if 'peak_traced_bytes' in report:
+        lines.append(f"Peak traced memory: {report['peak_traced_bytes'] / (1024 * 1024):.1f} MB")
+    return "\n".join(lines)
+
+
+def format_latency_comparison(serial, parallel, stages=('answers', 'total')):
+    """Side-by-side per-sheet latency of the serial and column-parallel answer stage"""
+    lines = [f"{'Latency (ms)':<16}{'serial':>10}{'parallel':>10}{'speedup':>10}"]
+    for stage in stages:
+        for name in ('p50_ms', 'p90_ms'):
+            before = serial['stages'][stage][name]
+            after = parallel['stages'][stage][name]
+            speedup = f"{before / after:.2f}x" if after else '-'
+            lines.append(f"{stage + ' ' + name[:3]:<16}{before:>10.2f}{after:>10.2f}{speedup:>10}")
+    return "\n".join(lines)
@@ -0,0 +1,171 @@
+"""Synthetic answer sheets with known answers
+
+Sheets follow the printed form the grid solver expects: a bordered landscape
+page with a header band, then 4 columns x 10 rows of numbered questions with
+4 numbered bubbles each. Distortions are drawn from a seeded generator so a
+benchmark run is reproducible.
+"""
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Form geometry in units of a 1200 px wide bordered area
+FORM_WIDTH = 1200
+FORM_HEIGHT = 820
+ROW_TOP = 193
+ROW_PITCH = 50
+COLUMN_LEFT = 95
+COLUMN_PITCH = 279
+OPTION_PITCH = 48
+BUBBLE_RADIUS = 15
+
+MARK_STYLES = ('pen_x', 'pencil_x', 'pen_fill', 'pencil_fill')
+
+INK = {
+    'pen': (90, 40, 30),      # blue-black ballpoint, BGR
+    'pencil': (95, 95, 95),
+}
+
+
+@dataclass
+class SheetSpec:
+    """How one synthetic sheet is marked and distorted"""
+    answers: dict
+    mark_style: str = 'pen_x'
+    scale: float = 1.0
+    rotation: float = 0.0
+    skew: float = 0.0
+    blur: int = 0
+    noise: float = 0.0
+    upside_down: bool = False
+    seed: int = 0
+
+
+def random_spec(rng, blank_rate=0.0, upside_down_rate=0.0):
+    """Draw a sheet with random answers, marks and distortions"""
+    answers = {}
+    for q in range(1, 41):
+        if rng.random() >= blank_rate:
+            answers[str(q)] = int(rng.integers(1, 5))
+    return SheetSpec(
+        answers=answers,
+        mark_style=str(rng.choice(MARK_STYLES)),
+        scale=float(rng.uniform(0.9, 3.0)),
+        rotation=float(rng.uniform(-3.0, 3.0)),
+        skew=float(rng.uniform(0.0, 0.05)),
+        blur=int(rng.choice([0, 0, 3, 5])),
+        noise=float(rng.uniform(0.0, 10.0)),
+        upside_down=bool(rng.random() < upside_down_rate),
+        seed=int(rng.integers(0, 2**31)),
+    )
+
+
+def _draw_mark(img, center, style, rng):
+    """Mark one bubble in the given style"""
+    ink = INK['pencil' if style.startswith('pencil') else 'pen']
+    cx, cy = center
+    r = BUBBLE_RADIUS
+    if style.endswith('_x'):
+        # Hand-drawn cross: slightly uneven strokes just past the outline
+        j = lambda: int(rng.integers(-2, 3))
+        d = int(r * 0.8)
+        thickness = 2 if style.startswith('pen') else 3
+        cv2.line(img, (cx - d + j(), cy - d + j()), (cx + d + j(), cy + d + j()), ink, thickness, cv2.LINE_AA)
+        cv2.line(img, (cx + d + j(), cy - d + j()), (cx - d + j(), cy + d + j()), ink, thickness, cv2.LINE_AA)
+    else:
+        cv2.circle(img, (cx, cy), r - 2, ink, -1, cv2.LINE_AA)
+        if style.startswith('pencil'):
+            # Graphite leaves a grainy, uneven fill
+            grain = rng.integers(0, 60, (2 * r, 2 * r), dtype=np.uint8)
+            roi = img[cy - r:cy + r, cx - r:cx + r]
+            mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+            cv2.circle(mask, (r, r), r - 2, 255, -1)
+            roi[mask > 0] = np.clip(roi[mask > 0].astype(np.int16) + grain[mask > 0, None], 0, 255)
+
+
+def render_form(spec):
+    """Draw the flat, undistorted sheet (paper with a small margin)"""
+    rng = np.random.default_rng(spec.seed)
+    margin = 24
+    img = np.full((FORM_HEIGHT + 2 * margin, FORM_WIDTH + 2 * margin, 3), 248, dtype=np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    def at(x, y):
+        return int(x) + margin, int(y) + margin
+
+    cv2.rectangle(img, at(0, 0), at(FORM_WIDTH, FORM_HEIGHT), (30, 30, 30), 2)
+
+    # Header: title lines, then the subject / medium / name boxes
+    for y, text, size in ((38, 'Department of Education', 0.8),
+                          (70, 'ANSWER SHEET', 0.8),
+                          (98, 'Year End Evaluation', 0.7)):
+        (tw, _), _ = cv2.getTextSize(text, font, size, 2)
+        cv2.putText(img, text, at((FORM_WIDTH - tw) / 2, y), font, size, (20, 20, 20), 2, cv2.LINE_AA)
+    cv2.putText(img, 'Subject', at(30, 145), font, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+    cv2.rectangle(img, at(215, 116), at(420, 162), (30, 30, 30), 2)
+    cv2.putText(img, 'Medium', at(505, 145), font, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+    cv2.rectangle(img, at(595, 116), at(690, 162), (30, 30, 30), 2)
+    cv2.putText(img, 'Name', at(705, 145), font, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+    cv2.rectangle(img, at(765, 116), at(1160, 162), (30, 30, 30), 2)
+    cv2.line(img, at(30, 170), at(FORM_WIDTH - 30, 170), (30, 30, 30), 2)
+
+    # Answer grid: question number, then four numbered bubbles
+    for col in range(4):
+        for row in range(10):
+            q = col * 10 + row + 1
+            y = ROW_TOP + row * ROW_PITCH
+            x0 = COLUMN_LEFT + col * COLUMN_PITCH
+            cv2.putText(img, str(q), at(x0 - 62, y + 8), font, 0.65, (30, 30, 30), 1, cv2.LINE_AA)
+            for opt in range(4):
+                center = at(x0 + opt * OPTION_PITCH, y)
+                cv2.circle(img, center, BUBBLE_RADIUS, (40, 40, 40), 1, cv2.LINE_AA)
+                cv2.putText(img, str(opt + 1), (center[0] - 6, center[1] + 7), font, 0.55,
+                            (60, 60, 60), 1, cv2.LINE_AA)
+            answer = spec.answers.get(str(q))
+            if answer:
+                _draw_mark(img, at(x0 + (answer - 1) * OPTION_PITCH, y), spec.mark_style, rng)
+
+    # Footer boxes below the grid, as on the printed form
+    cv2.line(img, at(30, 665), at(FORM_WIDTH - 30, 665), (30, 30, 30), 2)
+    for x in (225, 510, 790, 1070):
+        cv2.rectangle(img, at(x, 680), at(x + 70, 730), (30, 30, 30), 2)
+    cv2.rectangle(img, at(210, 745), at(410, 800), (30, 30, 30), 2)
+    cv2.rectangle(img, at(880, 745), at(1070, 800), (30, 30, 30), 2)
+    return img
+
+
+def render_sheet(spec):
+    """Render the sheet as a photo: placed on a desk, skewed, rotated, blurred, noisy"""
+    rng = np.random.default_rng(spec.seed + 1)
+    form = render_form(spec)
+    if spec.upside_down:
+        form = cv2.rotate(form, cv2.ROTATE_180)
+    h, w = form.shape[:2]
+
+    # Paper corners on a larger desk, jittered by the skew fraction
+    out_w, out_h = int(w * 1.2), int(h * 1.25)
+    jitter = lambda: rng.uniform(-spec.skew, spec.skew)
+    dst = np.float32([
+        [out_w * (0.08 + jitter()), out_h * (0.08 + jitter())],
+        [out_w * (0.92 + jitter()), out_h * (0.08 + jitter())],
+        [out_w * (0.92 + jitter()), out_h * (0.92 + jitter())],
+        [out_w * (0.08 + jitter()), out_h * (0.92 + jitter())],
+    ])
+    if spec.rotation:
+        centre = np.float32([out_w / 2, out_h / 2])
+        angle = np.deg2rad(spec.rotation)
+        rot = np.float32([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        dst = (dst - centre) @ rot.T + centre
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    photo = cv2.warpPerspective(form, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                                borderValue=(45, 50, 55))
+
+    if spec.scale != 1.0:
+        photo = cv2.resize(photo, None, fx=spec.scale, fy=spec.scale, interpolation=cv2.INTER_LINEAR)
+    if spec.blur:
+        photo = cv2.GaussianBlur(photo, (spec.blur, spec.blur), 0)
+    if spec.noise:
+        photo = np.clip(photo + rng.normal(0, spec.noise, photo.shape), 0, 255).astype(np.uint8)
+    return photo
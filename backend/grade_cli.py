@@ -0,0 +1,295 @@
+"""Grade a folder of scanned answer sheets from the command line
+
+    python grade_cli.py images/master_key.jpg scans/class_a --output class_a.csv
+    python grade_cli.py master_answers.json "scans/*.jpg" --output class_a.ndjson --db
+
+Sheets are graded across all cores and each result is appended to the output
+file as soon as it is ready. Re-running the same command skips sheets that
+are already in the output, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from main import (
+    BATCH_WORKERS, DB_FILE, DEFAULT_PROFILE, HEADER_FIELDS, MASTER_PROFILE, PROCESSING_PROFILES,
+    QUALITY_REASONS, DatabaseManager, EnhancedOMRProcessor, _init_batch_worker, _process_sheet, grade_answers
+)
+
+logger = logging.getLogger('grade_cli')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+OUTPUT_FIELDS = [
+    'file', 'student_id', 'name', 'medium', 'correct', 'wrong', 'unanswered', 'total',
+    'percentage', 'grade', 'profile', 'answers', 'error'
+]
+
+
+def find_sheets(inputs):
+    """Expand directories and glob patterns into a sorted, de-duplicated list of images"""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            paths = glob.glob(item) or [item]
+        found.extend(
+            os.path.abspath(path) for path in sorted(paths)
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return list(dict.fromkeys(found))
+
+
+def load_master(path, profile):
+    """Read the answer key from master_answers.json or a master sheet image
+
+    Returns (answers, layout); the layout is only known for images.
+    """
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            return {str(q): int(answer) for q, answer in json.load(f).items()}, None
+
+    with open(path, 'rb') as f:
+        processor = EnhancedOMRProcessor.from_bytes(f.read(), profile=profile, ocr_fields=())
+    if not processor.process():
+        if processor.rejected:
+            reason = processor.quality['reason']
+            raise SystemExit(f"Master key image rejected ({reason}): {QUALITY_REASONS[reason]}")
+        raise SystemExit(f"Could not read master key image: {path}")
+    unreliable = processor.unreliable_questions()
+    if unreliable:
+        raise SystemExit(f"Master key image {path}: questions {', '.join(unreliable)} "
+                         f"could not be read with confidence; rescan it or pass the key as JSON")
+    return processor.answers, processor.grid_layout
+
+
+def _init_worker(log_level):
+    """Batch worker setup, with the pipeline's per-stage logging turned down"""
+    logging.getLogger('main').setLevel(log_level)
+    _init_batch_worker()
+
+
+def _grade_file(path, profile, ocr_fields, template, trace_memory, quality_gate):
+    """Run the pipeline on one sheet file (executed inside a worker)"""
+    with open(path, 'rb') as f:
+        return _process_sheet(f.read(), profile, ocr_fields, template, trace_memory, quality_gate)
+
+
+class ResultWriter:
+    """Append-only CSV or NDJSON result file that remembers what it already holds"""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self._trim_partial_line()
+        self.rows = self._read_rows()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='')
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS)
+            if is_new:
+                self._csv.writeheader()
+
+    def _trim_partial_line(self):
+        """Drop a half-written last line left behind by a crash"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _read_rows(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, newline='') as f:
+            if self.fmt == 'csv':
+                return [row for row in csv.DictReader(f) if row.get('file')]
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+            return rows
+
+    def completed(self, retry_failed=False):
+        """Files already graded (or already failed, unless retrying them)"""
+        return {row['file'] for row in self.rows if not (retry_failed and row.get('error'))}
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow(dict(row, answers=json.dumps(row['answers'])))
+            else:
+                self._file.write(json.dumps(row) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def build_row(path, sheet, master_answers):
+    """Grade one processed sheet into an output row"""
+    student_id = os.path.splitext(os.path.basename(path))[0]
+    row = dict.fromkeys(OUTPUT_FIELDS, '')
+    row.update(file=path, student_id=student_id, answers={})
+    if sheet is None:
+        row['error'] = 'Image processing failed'
+        return row, None
+    if 'rejected' in sheet:
+        row['error'] = f"Rejected ({sheet['rejected']['reason']}): {QUALITY_REASONS[sheet['rejected']['reason']]}"
+        return row, None
+
+    results, _ = grade_answers(sheet['answers'], master_answers)
+    info = sheet['student_info']
+    row.update(
+        name=info.get('name', 'Unknown Student'),
+        medium=info.get('medium', 'Unknown'),
+        correct=results['correct'],
+        wrong=results['wrong'],
+        unanswered=results['unanswered'],
+        total=results['total'],
+        percentage=results['percentage'],
+        grade=DatabaseManager._calculate_grade(results['percentage']),
+        profile=sheet['profile'],
+        answers=sheet['answers']
+    )
+    return row, results
+
+
+def resolve_master_key_id(db, subject, grade_level, exam_date, answers, layout):
+    """Reuse the active master key when it is this one, otherwise register it"""
+    active = db.get_active_master_key()
+    if (active and active['subject'] == subject and active['grade_level'] == grade_level
+            and active['answers'] == answers):
+        return active['id']
+    return db.add_master_key(subject, exam_date, grade_level, answers, layout=layout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade scanned answer sheets in parallel")
+    parser.add_argument('master', help="master key image or master_answers.json")
+    parser.add_argument('inputs', nargs='+', help="sheet images, directories or glob patterns")
+    parser.add_argument('-o', '--output', required=True, help="results file (.csv or .ndjson)")
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help="output format (default: from the output file extension)")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help="worker processes")
+    parser.add_argument('--profile', choices=sorted(PROCESSING_PROFILES), default=DEFAULT_PROFILE,
+                        help="processing profile for student sheets")
+    parser.add_argument('--no-ocr', action='store_true', help="skip reading names from the sheet header")
+    parser.add_argument('--retry-failed', action='store_true', help="re-grade sheets that failed last time")
+    parser.add_argument('--no-quality-gate', action='store_true',
+                        help="grade every sheet, even ones the capture checks would reject")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="measure each sheet's peak memory (slower; sizes --workers per host)")
+    parser.add_argument('--db', nargs='?', const=DB_FILE, metavar='PATH',
+                        help="also load results into the grading database (default: the server's)")
+    parser.add_argument('--subject', default='General', help="subject recorded in the database")
+    parser.add_argument('--grade-level', default='General', help="grade level recorded in the database")
+    parser.add_argument('--exam-date', default=datetime.now().strftime('%Y-%m-%d'),
+                        help="exam date recorded in the database")
+    parser.add_argument('--db-batch', type=int, default=50, help="results per database transaction")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show pipeline logging")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger('main').setLevel(log_level)
+    logger.setLevel(logging.INFO)
+
+    fmt = args.format or ('ndjson' if args.output.lower().endswith(('.ndjson', '.jsonl')) else 'csv')
+    sheets = find_sheets(args.inputs)
+    if not sheets:
+        raise SystemExit("No sheet images found")
+
+    master_answers, layout = load_master(args.master, MASTER_PROFILE)
+    logger.info(f"Master key: {len(master_answers)} answers"
+                f"{' with bubble layout' if layout else ''}")
+
+    db = master_key_id = None
+    if args.db:
+        db = DatabaseManager(args.db)
+        master_key_id = resolve_master_key_id(
+            db, args.subject, args.grade_level, args.exam_date, master_answers, layout
+        )
+        if not master_key_id:
+            raise SystemExit("Could not save the master key to the database")
+
+    writer = ResultWriter(args.output, fmt)
+    done = writer.completed(args.retry_failed)
+    todo = [path for path in sheets if path not in done]
+    logger.info(f"{len(sheets)} sheets, {len(sheets) - len(todo)} already graded, {len(todo)} to go")
+
+    ocr_fields = () if args.no_ocr else HEADER_FIELDS
+    pending = []
+
+    def flush():
+        # Rows reach the output only after their database batch committed, so
+        # a resumed run never skips a sheet that is missing from the database
+        if not pending:
+            return
+        entries = [entry for _, entry in pending if entry]
+        if db and entries and not db.add_grading_results_batch(entries):
+            raise SystemExit("Database load failed; re-run to resume")
+        writer.write([row for row, _ in pending])
+        pending.clear()
+
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(log_level,))
+    graded = 0
+    peak_memory = 0
+    try:
+        futures = {
+            pool.submit(_grade_file, path, args.profile, ocr_fields, layout, args.trace_memory,
+                        False if args.no_quality_gate else None): path
+            for path in todo
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                sheet = future.result()
+                row, results = build_row(path, sheet, master_answers)
+                if sheet and sheet['peak_memory'] is not None:
+                    peak_memory = max(peak_memory, sheet['peak_memory'])
+            except Exception as e:
+                row, results = build_row(path, None, master_answers)
+                row['error'] = str(e)
+
+            entry = None
+            if db and results:
+                entry = {
+                    'student_id': row['student_id'],
+                    'name': row['name'],
+                    'subject': args.subject,
+                    'medium': row['medium'],
+                    'grade_level': args.grade_level,
+                    'exam_date': args.exam_date,
+                    'results': results,
+                    'answers': row['answers'],
+                    'master_key_id': master_key_id
+                }
+            pending.append((row, entry))
+            if not db or len(pending) >= args.db_batch:
+                flush()
+
+            graded += 1
+            status = row['error'] or f"{row['correct']}/{row['total']}"
+            logger.info(f"[{graded}/{len(todo)}] {os.path.basename(path)}: {status}")
+    finally:
+        pool.shutdown(cancel_futures=True)
+        flush()
+        writer.close()
+        if args.trace_memory:
+            logger.info(f"Peak memory per sheet: {peak_memory / 2**20:.1f} MB")
+
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    sys.exit(main())
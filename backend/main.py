@@ -1,20 +1,31 @@
 import cv2
 import numpy as np
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import io
 import os
+import uuid
 import json
 import pytesseract
 from PIL import Image
 import logging
 import re
 import sqlite3
+import threading
+import time
+import tracemalloc
+import functools
+import atexit
+import hashlib
+import socket
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils.dataframe import dataframe_to_rows
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,7 +33,29 @@ logger = logging.getLogger(__name__)
 # Configure Tesseract (optional - comment out if not installed)
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+
+
+class InMemoryRequest(Request):
+    """Request that buffers uploaded files in memory instead of temp files"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an uploaded image exceeds MAX_UPLOAD_BYTES"""
+
+
+class QueueFullError(Exception):
+    """Raised when the grading job queue already holds JOB_QUEUE_LIMIT jobs"""
+    
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 CORS(app)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -32,30 +65,458 @@ MASTER_METADATA_FILE = os.path.join(BASE_DIR, 'master_metadata.json')
 DB_FILE = os.path.join(BASE_DIR, 'omr_grading.db')
 EXPORTS_DIR = os.path.join(BASE_DIR, 'exports')
 
+# Connections to the grading database are pooled (up to DB_POOL_SIZE idle)
+# instead of opened per call, and run in WAL mode so analytics reads do not
+# block grading writes. synchronous=NORMAL only risks the last commits on
+# power loss, never corruption.
+DB_POOL_SIZE = int(os.environ.get('OMR_DB_POOL_SIZE', 8))
+DB_MMAP_SIZE = int(os.environ.get('OMR_DB_MMAP_SIZE', 64 * 1024 * 1024))
+DB_STATEMENT_CACHE = 256
+DB_BUSY_TIMEOUT = 30
+
+# Student upserts and result inserts are group-committed by a background
+# writer: one transaction per WRITE_BATCH_ROWS writes (a sheet, or a whole
+# /grade_batch upload) or WRITE_FLUSH_MS. With WRITE_DURABLE, /grade_student
+# waits for its rows to commit before replying.
+WRITE_BATCH_ROWS = int(os.environ.get('OMR_WRITE_BATCH_ROWS', 64))
+WRITE_FLUSH_MS = float(os.environ.get('OMR_WRITE_FLUSH_MS', 20))
+WRITE_DURABLE = os.environ.get('OMR_WRITE_DURABLE', '1') == '1'
+
+# Worker processes used by /grade_batch (defaults to one per core)
+BATCH_WORKERS = int(os.environ.get('OMR_BATCH_WORKERS', os.cpu_count() or 1))
+
+# Grading jobs (/jobs) live in their own SQLite file so they survive restarts.
+# JOB_WORKERS threads hand sheets to the batch pool; submissions beyond
+# JOB_QUEUE_LIMIT unfinished jobs get 429. Finished jobs are kept for
+# JOB_RETENTION_SECONDS so clients can still collect their results. A running
+# job is leased to the process that claimed it; the lease is renewed while the
+# process lives and the job is queued again once it lapses.
+JOBS_DB_FILE = os.path.join(BASE_DIR, 'omr_jobs.db')
+JOB_WORKERS = int(os.environ.get('OMR_JOB_WORKERS', BATCH_WORKERS))
+JOB_QUEUE_LIMIT = int(os.environ.get('OMR_JOB_QUEUE_LIMIT', 64))
+JOB_RETENTION_SECONDS = int(os.environ.get('OMR_JOB_RETENTION_SECONDS', 24 * 3600))
+JOB_LEASE_SECONDS = int(os.environ.get('OMR_JOB_LEASE_SECONDS', 60))
+JOB_POLL_SECONDS = 5.0
+JOB_EVENT_KEEPALIVE_SECONDS = 15.0
+
+# A re-submitted upload (same bytes, master key and form fields) within
+# RESULT_CACHE_TTL seconds gets the cached result, not a regrade and a second
+# row. PERCEPTUAL_DEDUP also matches re-encoded copies whose difference hash
+# is within PERCEPTUAL_MAX_DISTANCE of 256 bits; it is off by default because
+# it trusts a near match. Clients may also send an Idempotency-Key header,
+# which is stored with the result row and never graded twice.
+RESULT_CACHE_SIZE = int(os.environ.get('OMR_RESULT_CACHE_SIZE', 256))
+RESULT_CACHE_TTL = float(os.environ.get('OMR_RESULT_CACHE_TTL', 600))
+PERCEPTUAL_DEDUP = os.environ.get('OMR_PERCEPTUAL_DEDUP', '0') == '1'
+PERCEPTUAL_HASH_SIZE = 16
+PERCEPTUAL_MAX_DISTANCE = int(os.environ.get('OMR_PERCEPTUAL_MAX_DISTANCE', 10))
+
+# Upload limits: per image, and per request (a batch carries many images)
+MAX_UPLOAD_BYTES = int(os.environ.get('OMR_MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('OMR_MAX_REQUEST_BYTES', 512 * 1024 * 1024))
+
+# Uploads are decoded in memory; set OMR_SAVE_UPLOADS=1 to also keep copies in IMAGE_DIR
+SAVE_UPLOADS = os.environ.get('OMR_SAVE_UPLOADS', '0') == '1'
+
+# Processing profiles trade denoising cost for robustness. Cheap profiles
+# re-run the answer stage with 'escalate_to' when any question is missed or
+# low-confidence, keeping the more confident read and, per question, the more
+# confident answer of the two.
+PROCESSING_PROFILES = {
+    'fast': {'denoise': 'median', 'escalate_to': 'accurate'},
+    'balanced': {'denoise': 'bilateral', 'escalate_to': 'accurate'},
+    'accurate': {'denoise': 'nlm', 'escalate_to': None},
+}
+DEFAULT_PROFILE = os.environ.get('OMR_PROFILE', 'fast')
+# Master keys take the same escalating path (NLM alone misreads some thin
+# crosses) and are refused unless every question is read with confidence
+MASTER_PROFILE = 'fast'
+
+# A question is answered when its strongest bubble beats the row average by
+# MARK_MARGIN_THRESHOLD. Margins between ESCALATION_MIN_MARGIN and
+# ESCALATION_MAX_MARGIN (faint marks, smudges) are low-confidence: on
+# synthetic sheets blank rows stay under 0.05 and clear marks above 0.09.
+MARK_MARGIN_THRESHOLD = 0.07
+ESCALATION_MIN_MARGIN = 0.04
+ESCALATION_MAX_MARGIN = 0.10
+
+# Orientation is read from the bubble grid on a thumbnail; Tesseract OSD is
+# only consulted when that is inconclusive and OMR_OSD_FALLBACK=1.
+ORIENTATION_THUMB_SIZE = 800
+OSD_FALLBACK = os.environ.get('OMR_OSD_FALLBACK', '0') == '1'
+# Clockwise page rotation -> rotation that makes it upright
+ROTATION_FIXES = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+
+# Uploads are decoded at 1/2, 1/4 or 1/8 size (JPEG DCT scaling) as long as
+# the long side stays at least DECODE_MIN_SIZE, which keeps a sheet filling
+# 90% of the frame at or above CANONICAL_SHEET_WIDTH.
+DECODE_MIN_SIZE = int(os.environ.get('OMR_DECODE_MIN_SIZE', 2000))
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Page detection runs on the smallest pyramid level at least PAGE_DETECT_SIZE and
+# stops early once a quad covers PAGE_EARLY_EXIT_FRACTION of that level.
+# Sheets are then warped to a fixed width so later pixel thresholds hold. Below
+# about 1800 px the NLM denoiser of the 'accurate' profile erases thin crosses.
+PAGE_DETECT_SIZE = 1000
+PAGE_EARLY_EXIT_FRACTION = 0.85
+CANONICAL_SHEET_WIDTH = 1800
+
+# Answer-stage pixel thresholds were tuned on sheets THRESHOLD_REFERENCE_WIDTH
+# px wide and are scaled to CANONICAL_SHEET_WIDTH (areas by the square), i.e.
+# by 1.5 at the 1800 px warp: bubbles of 80-5000 px² there are 180-11250 here.
+THRESHOLD_REFERENCE_WIDTH = 1200
+THRESHOLD_SCALE = CANONICAL_SHEET_WIDTH / THRESHOLD_REFERENCE_WIDTH
+BUBBLE_MIN_AREA = 80 * THRESHOLD_SCALE ** 2
+BUBBLE_MAX_AREA = 5000 * THRESHOLD_SCALE ** 2
+MARK_ROI_PAD = max(1, int(round(3 * THRESHOLD_SCALE)))
+ANSWER_THRESHOLD_BLOCK = max(3, int(round(15 * THRESHOLD_SCALE)) | 1)
+
+# Student sheets are sampled at the master key's bubble layout when, after
+# shifting it by up to TEMPLATE_SEARCH_RADIUS bubble sizes, every row and slot
+# track has at least TEMPLATE_MIN_FIT of its bubble outlines on ink.
+TEMPLATE_SEARCH_RADIUS = 0.75
+TEMPLATE_MIN_FIT = 0.25
+
+# Capture checks run on a QUALITY_THUMB_SIZE thumbnail before the pipeline.
+# A sheet is rejected when its Laplacian variance is below QUALITY_MIN_SHARPNESS,
+# when no page quad is found, or when glare covers more than QUALITY_MAX_GLARE
+# of the page. Glare is paper clipped to QUALITY_CLIP_LEVEL or brighter with no
+# ink anywhere in a QUALITY_GLARE_WINDOW square, on a page whose median is
+# below the clip level (an evenly white flatbed scan is not glare).
+QUALITY_GATE = os.environ.get('OMR_QUALITY_GATE', '1') == '1'
+QUALITY_THUMB_SIZE = 640
+QUALITY_MIN_SHARPNESS = float(os.environ.get('OMR_MIN_SHARPNESS', 150))
+QUALITY_MAX_GLARE = float(os.environ.get('OMR_MAX_GLARE', 0.05))
+QUALITY_CLIP_LEVEL = 250
+QUALITY_GLARE_WINDOW = 31
+
+# Machine-readable rejection reasons and the retake hint shown for each
+QUALITY_REASONS = {
+    'blurry': "The photo is blurry. Hold the phone steady and retake it.",
+    'no_page': "The whole sheet is not in view. Fit all four corners in the frame and retake it.",
+    'glare': "Glare is washing out part of the sheet. Avoid direct light and retake it.",
+}
+
+# Per-stage wall-clock timings; when off, stage methods pay one attribute check
+STAGE_TIMINGS = os.environ.get('OMR_STAGE_TIMINGS', '1') == '1'
+
+# Lean mode (opt-in with OMR_LEAN_MODE=1) keeps one grayscale copy of the sheet
+# and drops the input, the rotated image and, once answers are read, the warped
+# sheet, so callers that inspect those afterwards must leave it off.
+# OMR_TRACE_MEMORY measures each sheet's peak allocation with tracemalloc.
+# Tracing is process-wide: it counts every thread's allocations, so traced runs
+# are serialized and the server only traces in batch worker processes, never in
+# request threads.
+LEAN_MODE = os.environ.get('OMR_LEAN_MODE', '0') == '1'
+TRACE_MEMORY = os.environ.get('OMR_TRACE_MEMORY', '0') == '1'
+_trace_lock = threading.Lock()
+
+# Optionally split the answer area into COLUMN_TILES vertical strips and run
+# denoising, thresholding, contour search and scoring on them in threads (cv2
+# releases the GIL). Strips overlap their neighbours by enough for every
+# filter window (COLUMN_FILTER_PAD) and every bubble contour (COLUMN_CONTOUR_PAD)
+# to see the same pixels as on the whole area, so results do not change.
+PARALLEL_COLUMNS = os.environ.get('OMR_PARALLEL_COLUMNS', '0') == '1'
+COLUMN_TILES = 4
+COLUMN_FILTER_PAD = max(16, ANSWER_THRESHOLD_BLOCK)
+COLUMN_CONTOUR_PAD = max(16, int(round(64 * THRESHOLD_SCALE)))
+
+# Header fields read by OCR, as fractions of the sheet width
+HEADER_FIELD_BOUNDS = {
+    'subject': (0.10, 0.30),
+    'medium': (0.40, 0.55),
+    'name': (0.58, 0.95),
+}
+HEADER_FIELDS = tuple(HEADER_FIELD_BOUNDS)
+
 os.makedirs(IMAGE_DIR, exist_ok=True)
 os.makedirs(EXPORTS_DIR, exist_ok=True)
 
 
+# ==================== ANSWER PACKING ====================
+# Answers are stored as one byte per question (question q at offset q - 1),
+# holding the option 1-4 or 0 when unanswered. A cohort of blobs maps onto a
+# (students x 40) uint8 matrix without any parsing; dicts keyed by question
+# number are only built at the API boundary.
+
+def pack_answers(answers):
+    """{question: option} -> 40-byte blob"""
+    packed = bytearray(40)
+    for q, option in answers.items():
+        q = int(q)
+        if 1 <= q <= 40:
+            packed[q - 1] = option
+    return bytes(packed)
+
+
+def unpack_answers(blob):
+    """40-byte blob -> read-only uint8 vector"""
+    return np.frombuffer(blob, dtype=np.uint8)
+
+
+def unpack_answer_matrix(blobs):
+    """Sequence of 40-byte blobs -> (len x 40) uint8 matrix"""
+    return np.frombuffer(b''.join(blobs), dtype=np.uint8).reshape(-1, 40)
+
+
+def answers_dict(vector):
+    """uint8 answer vector -> {question: option} of the answered questions"""
+    return {str(q + 1): int(option) for q, option in enumerate(vector.tolist()) if option}
+
+
+def score_answer_matrix(key, matrix):
+    """Score a (students x 40) answer matrix against a key vector in one pass
+    
+    Returns (correct, wrong, unanswered) count arrays, the number of keyed
+    questions and the percentages, rounded with Python's round().
+    """
+    keyed = key > 0
+    correct = ((matrix == key) & keyed).sum(axis=1)
+    unanswered = ((matrix == 0) & keyed).sum(axis=1)
+    total = int(keyed.sum())
+    wrong = total - correct - unanswered
+    percentage = [round(p, 2) for p in (correct / total * 100).tolist()] if total else [0] * len(matrix)
+    return correct, wrong, unanswered, total, percentage
+
+
+class GroupCommitWriter:
+    """Background thread that commits queued writes of many requests together
+    
+    A write is a list of (statement, params) that commits as a unit (a
+    sheet's student upsert and result, or a whole /grade_batch). Writes are
+    flushed in one transaction once WRITE_BATCH_ROWS are waiting or
+    WRITE_FLUSH_MS after the oldest was queued. A durable write is flushed
+    at once, together with everything queued before it; writes that arrive
+    during that commit share the next one. Each write gets a Future that
+    resolves to True once committed, or False if it failed.
+    """
+    
+    def __init__(self, db, batch_rows=WRITE_BATCH_ROWS, flush_ms=WRITE_FLUSH_MS):
+        self.db = db
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_ms / 1000.0
+        self._cond = threading.Condition()
+        self._pending = []  # (statements, future, log message, queued at)
+        self._committing = []
+        self._urgent = False
+        self._thread = threading.Thread(target=self._run, name='omr-db-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, statements, message=None, durable=False):
+        """Queue one write, a list of (statement, params), and return its Future"""
+        future = Future()
+        with self._cond:
+            self._pending.append((statements, future, message, time.monotonic()))
+            self._urgent = self._urgent or durable
+            self._cond.notify_all()
+        return future
+    
+    def flush(self):
+        """Commit everything queued so far and wait for it"""
+        with self._cond:
+            futures = [entry[1] for entry in self._committing + self._pending]
+            self._urgent = bool(self._pending)
+            self._cond.notify_all()
+        for future in futures:
+            future.result()
+    
+    def _due(self):
+        return (self._urgent or len(self._pending) >= self.batch_rows
+                or time.monotonic() >= self._pending[0][3] + self.flush_seconds)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                while not self._due():
+                    self._cond.wait(self._pending[0][3] + self.flush_seconds - time.monotonic())
+                batch, self._pending, self._urgent = self._pending, [], False
+                self._committing = batch
+            self._commit(batch)
+            with self._cond:
+                self._committing = []
+    
+    def _commit(self, batch):
+        try:
+            outcomes = self._write_batch(batch)
+        except Exception as e:
+            # e.g. the database could not be opened; never leave a caller
+            # waiting, and keep this thread alive for later writes
+            logger.error(f"Database writes failed: {e}")
+            outcomes = [False] * len(batch)
+        
+        for (_, future, message, _), ok in zip(batch, outcomes):
+            if ok and message:
+                logger.info(message)
+            future.set_result(ok)
+    
+    def _write_batch(self, batch):
+        """Run a batch in one transaction, falling back to one write at a time; returns success per write"""
+        conn = self.db._connect()
+        try:
+            try:
+                # One executemany per statement, in first-queued order; rows of
+                # the same statement keep their queue order
+                grouped = {}
+                for statements, _, _, _ in batch:
+                    for statement, params in statements:
+                        grouped.setdefault(statement, []).append(params)
+                for statement, rows in grouped.items():
+                    conn.executemany(statement, rows)
+                conn.commit()
+                outcomes = [True] * len(batch)
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Group commit of {len(batch)} writes failed, retrying one by one: {e}")
+                outcomes = []
+                for statements, _, _, _ in batch:
+                    try:
+                        for statement, params in statements:
+                            conn.execute(statement, params)
+                        conn.commit()
+                        outcomes.append(True)
+                    except Exception as e:
+                        conn.rollback()
+                        logger.error(f"Database write failed: {e}")
+                        outcomes.append(False)
+        finally:
+            self.db._release(conn)
+        return outcomes
+
+
 class DatabaseManager:
     """Enhanced database manager with filtering and analytics"""
     
-    def __init__(self, db_path):
+    def __init__(self, db_path, initialize=True, pooled=True):
         self.db_path = db_path
-        self.init_database()
+        # pooled=False opens a plain connection per call (for comparisons)
+        self.pooled = pooled
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._pool_pid = os.getpid()
+        self._writer = None
+        self._writer_pid = None
+        # Active master key, parsed once and kept until the database changes
+        self._master_lock = threading.Lock()
+        self._master_cache = None
+        self._master_version = None
+        self._master_packed = None
+        self._version_conn = None
+        self._version_pid = None
+        # init_database() only adds what is missing, so opening a live
+        # database is safe; initialize=False skips even the version check
+        if initialize:
+            self.init_database()
+    
+    def _open(self, **kwargs):
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT,
+                               cached_statements=DB_STATEMENT_CACHE, **kwargs)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        return conn
+    
+    def _connect(self):
+        """Take an idle pooled connection, or open one"""
+        if not self.pooled:
+            return sqlite3.connect(self.db_path)
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                # Connections must not cross a fork; the child opens its own
+                self._pool, self._pool_pid = [], os.getpid()
+            if self._pool:
+                return self._pool.pop()
+        return self._open(check_same_thread=False)
+    
+    def _release(self, conn):
+        """Return a connection to the pool, ending any transaction a failed call left open"""
+        if not self.pooled:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        with self._pool_lock:
+            if len(self._pool) < DB_POOL_SIZE and self._pool_pid == os.getpid():
+                self._pool.append(conn)
+                return
+        conn.close()
+    
+    # Schema changes, applied in order by init_database(); the schema version
+    # is the number applied. Each step only adds what is missing, so it is
+    # also safe on databases created before versioning was introduced.
+    MIGRATIONS = (
+        '_create_tables',
+        '_add_master_layout',
+        '_add_idempotency_key',
+        '_index_results_by_master_key',
+        '_pack_answers',
+    )
+    SCHEMA_VERSION = len(MIGRATIONS)
+    
+    @staticmethod
+    def _schema_version(conn):
+        try:
+            row = conn.execute('SELECT version FROM schema_version').fetchone()
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] if row else 0
+    
+    @staticmethod
+    def _columns(conn, table):
+        return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
     
     def init_database(self):
-        """Initialize database with enhanced schema"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Drop existing tables to recreate with enhanced schema
-        cursor.execute('DROP TABLE IF EXISTS grading_results')
-        cursor.execute('DROP TABLE IF EXISTS students')
-        cursor.execute('DROP TABLE IF EXISTS master_keys')
+        """Bring the schema up to SCHEMA_VERSION without touching existing data
         
-        # Students table
-        cursor.execute('''
-            CREATE TABLE students (
+        Costs one version check once the schema is current. Pending
+        migrations run in a single write transaction, so processes starting
+        together on the same file migrate it once.
+        """
+        conn = self._connect()
+        try:
+            if self._schema_version(conn) >= self.SCHEMA_VERSION:
+                return
+            
+            conn.execute('BEGIN IMMEDIATE')
+            # Re-read under the write lock: another process may have just migrated
+            version = self._schema_version(conn)
+            if version >= self.SCHEMA_VERSION:
+                conn.rollback()
+                return
+            conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+            for number, name in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                getattr(self, name)(conn)
+                logger.info(f"✓ Database migration {number}: {name.strip('_').replace('_', ' ')}")
+            conn.execute('DELETE FROM schema_version')
+            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (self.SCHEMA_VERSION,))
+            conn.commit()
+            logger.info(f"✓ Database schema at version {self.SCHEMA_VERSION}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+            self.invalidate_master_cache()
+    
+    def _create_tables(self, conn):
+        """Create any missing table, in its current shape, and the base indexes"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS students (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 student_id TEXT UNIQUE NOT NULL,
                 name TEXT NOT NULL,
@@ -68,8 +529,8 @@ class DatabaseManager:
         ''')
         
         # Grading results table with enhanced fields
-        cursor.execute('''
-            CREATE TABLE grading_results (
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS grading_results (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 student_id TEXT NOT NULL,
                 exam_date DATE NOT NULL,
@@ -82,115 +543,194 @@ class DatabaseManager:
                 score REAL NOT NULL,
                 percentage REAL NOT NULL,
                 grade TEXT NOT NULL,
-                answers_json TEXT NOT NULL,
+                answers_packed BLOB NOT NULL,
                 master_key_id INTEGER,
+                idempotency_key TEXT,
                 graded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (student_id) REFERENCES students(student_id),
                 FOREIGN KEY (master_key_id) REFERENCES master_keys(id)
             )
         ''')
         
-        # Master keys table
-        cursor.execute('''
-            CREATE TABLE master_keys (
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS master_keys (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 subject TEXT NOT NULL,
                 exam_date DATE NOT NULL,
                 grade_level TEXT NOT NULL,
                 total_questions INTEGER NOT NULL,
-                answers_json TEXT NOT NULL,
+                answers_packed BLOB NOT NULL,
+                layout_json TEXT,
                 is_active BOOLEAN DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
         # Indexes for performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_student_id ON students(student_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_grading_student_id ON grading_results(student_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_grading_subject ON grading_results(subject)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_grading_grade_level ON grading_results(grade_level)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_grading_exam_date ON grading_results(exam_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_master_active ON master_keys(is_active)')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✓ Enhanced database initialized")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_student_id ON students(student_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_student_id ON grading_results(student_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_subject ON grading_results(subject)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_grade_level ON grading_results(grade_level)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_exam_date ON grading_results(exam_date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_master_active ON master_keys(is_active)')
+    
+    def _add_master_layout(self, conn):
+        """Bubble layout of the master sheet"""
+        if 'layout_json' not in self._columns(conn, 'master_keys'):
+            conn.execute('ALTER TABLE master_keys ADD COLUMN layout_json TEXT')
+    
+    def _add_idempotency_key(self, conn):
+        """Idempotency-Key of the request that saved a result, unique when set"""
+        if 'idempotency_key' not in self._columns(conn, 'grading_results'):
+            conn.execute('ALTER TABLE grading_results ADD COLUMN idempotency_key TEXT')
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_grading_idempotency_key ON grading_results(idempotency_key)
+        ''')
+    
+    def _index_results_by_master_key(self, conn):
+        """Index for rescoring and item analysis"""
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_master_key ON grading_results(master_key_id)')
     
-    def add_student(self, student_id, name, subject=None, medium=None, grade_level=None):
+    def _pack_answers(self, conn):
+        """Convert answers stored as JSON text to packed blobs"""
+        for table in ('master_keys', 'grading_results'):
+            columns = self._columns(conn, table)
+            if 'answers_json' not in columns:
+                continue
+            if 'answers_packed' not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN answers_packed BLOB')
+            rows = conn.execute(f'SELECT id, answers_json FROM {table}').fetchall()
+            conn.executemany(
+                f'UPDATE {table} SET answers_packed = ? WHERE id = ?',
+                [(pack_answers(json.loads(answers_json)), row_id) for row_id, answers_json in rows]
+            )
+            conn.execute(f'ALTER TABLE {table} DROP COLUMN answers_json')
+            logger.info(f"✓ Packed answers of {len(rows)} {table} rows")
+    
+    STUDENT_UPSERT = '''
+        INSERT OR REPLACE INTO students 
+        (student_id, name, subject, medium, grade_level, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    '''
+    
+    RESULT_INSERT = '''
+        INSERT INTO grading_results 
+        (student_id, exam_date, subject, grade_level, total_questions, correct_answers, 
+         wrong_answers, unanswered, score, percentage, grade, answers_packed, master_key_id,
+         idempotency_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(idempotency_key) DO NOTHING
+    '''
+    
+    def _write(self, statements, message, durable):
+        """Queue a write, a list of (statement, params) that commits as a unit;
+        durable waits for its commit
+        
+        Returns whether the write committed, or True once queued when not
+        durable. Unpooled managers commit every write on its own, as before.
+        """
+        if not self.pooled:
+            conn = self._connect()
+            try:
+                for statement, params in statements:
+                    conn.execute(statement, params)
+                conn.commit()
+                logger.info(message)
+                return True
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Database write failed: {e}")
+                return False
+            finally:
+                self._release(conn)
+        
+        with self._pool_lock:
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._writer, self._writer_pid = GroupCommitWriter(self), os.getpid()
+                atexit.register(self._writer.flush)
+            writer = self._writer
+        future = writer.submit(statements, message, durable)
+        return future.result() if durable else True
+    
+    def flush_writes(self):
+        """Wait until every queued write has been committed"""
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._writer.flush()
+    
+    def add_student(self, student_id, name, subject=None, medium=None, grade_level=None, durable=False):
         """Add or update student information"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO students 
-                (student_id, name, subject, medium, grade_level, updated_at)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (student_id, name, subject, medium, grade_level))
-            
-            conn.commit()
-            logger.info(f"✓ Student added/updated: {name} ({student_id})")
-            return True
-        except Exception as e:
-            logger.error(f"Error adding student: {e}")
-            return False
-        finally:
-            conn.close()
+        return self._write(
+            [(self.STUDENT_UPSERT, (student_id, name, subject, medium, grade_level))],
+            f"✓ Student added/updated: {name} ({student_id})", durable
+        )
     
-    def add_grading_result(self, student_id, subject, grade_level, exam_date, results, answers, master_key_id=None):
-        """Add grading result"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Calculate grade
-            percentage = results['percentage']
-            if percentage >= 90:
-                grade = 'A+'
-            elif percentage >= 80:
-                grade = 'A'
-            elif percentage >= 70:
-                grade = 'B'
-            elif percentage >= 60:
-                grade = 'C'
-            elif percentage >= 50:
-                grade = 'D'
-            else:
-                grade = 'F'
-            
-            cursor.execute('''
-                INSERT INTO grading_results 
-                (student_id, exam_date, subject, grade_level, total_questions, correct_answers, 
-                 wrong_answers, unanswered, score, percentage, grade, answers_json, master_key_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                student_id,
-                exam_date,
-                subject,
-                grade_level,
-                results['total'],
-                results['correct'],
-                results['wrong'],
-                results['unanswered'],
-                results['score'],
-                results['percentage'],
-                grade,
-                json.dumps(answers),
-                master_key_id
+    def _result_params(self, student_id, subject, grade_level, exam_date, results, answers, master_key_id,
+                       idempotency_key):
+        return (
+            student_id,
+            exam_date,
+            subject,
+            grade_level,
+            results['total'],
+            results['correct'],
+            results['wrong'],
+            results['unanswered'],
+            results['score'],
+            results['percentage'],
+            self._calculate_grade(results['percentage']),
+            pack_answers(answers),
+            master_key_id,
+            idempotency_key
+        )
+    
+    def add_grading_result(self, student_id, subject, grade_level, exam_date, results, answers, master_key_id=None,
+                           idempotency_key=None, durable=False):
+        """Add grading result (once per idempotency key, when one is given)"""
+        params = self._result_params(student_id, subject, grade_level, exam_date, results, answers,
+                                     master_key_id, idempotency_key)
+        return self._write(
+            [(self.RESULT_INSERT, params)],
+            f"✓ Grading result saved: {student_id} - {params[10]} ({results['percentage']}%)", durable
+        )
+    
+    def add_grading_results_batch(self, entries, durable=True):
+        """Add students and grading results for a batch of sheets as one write
+        
+        Every student row commits together with the results that reference
+        it, so a result is never saved without the student that get_all_results
+        joins it to. Goes through the group-commit writer like single sheets.
+        """
+        statements = [
+            (self.STUDENT_UPSERT, (e['student_id'], e['name'], e['subject'], e['medium'], e['grade_level']))
+            for e in entries
+        ]
+        statements += [
+            (self.RESULT_INSERT, self._result_params(
+                e['student_id'], e['subject'], e['grade_level'], e['exam_date'], e['results'], e['answers'],
+                e['master_key_id'], e.get('idempotency_key')
             ))
-            
-            conn.commit()
-            logger.info(f"✓ Grading result saved: {student_id} - {grade} ({percentage}%)")
-            return True
-        except Exception as e:
-            logger.error(f"Error adding grading result: {e}")
-            return False
-        finally:
-            conn.close()
+            for e in entries
+        ]
+        return self._write(statements, f"✓ Batch saved: {len(entries)} grading results", durable)
+    
+    @staticmethod
+    def _calculate_grade(percentage):
+        """Map a percentage to a letter grade"""
+        if percentage >= 90:
+            return 'A+'
+        elif percentage >= 80:
+            return 'A'
+        elif percentage >= 70:
+            return 'B'
+        elif percentage >= 60:
+            return 'C'
+        elif percentage >= 50:
+            return 'D'
+        return 'F'
     
-    def add_master_key(self, subject, exam_date, grade_level, answers):
-        """Add master answer key"""
-        conn = sqlite3.connect(self.db_path)
+    def add_master_key(self, subject, exam_date, grade_level, answers, layout=None):
+        """Add master answer key, with the sheet's bubble layout when known"""
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
@@ -203,54 +743,240 @@ class DatabaseManager:
             
             # Insert new master key
             cursor.execute('''
-                INSERT INTO master_keys (subject, exam_date, grade_level, total_questions, answers_json, is_active)
-                VALUES (?, ?, ?, ?, ?, 1)
-            ''', (subject, exam_date, grade_level, len(answers), json.dumps(answers)))
+                INSERT INTO master_keys (subject, exam_date, grade_level, total_questions, answers_packed,
+                                         layout_json, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+            ''', (subject, exam_date, grade_level, len(answers), pack_answers(answers),
+                  json.dumps(layout) if layout else None))
             
             master_key_id = cursor.lastrowid
             
             conn.commit()
+            self.invalidate_master_cache()
             logger.info(f"✓ Master key saved: {subject} - {grade_level} (ID: {master_key_id})")
             return master_key_id
         except Exception as e:
             logger.error(f"Error adding master key: {e}")
             return None
         finally:
-            conn.close()
+            self._release(conn)
+    
+    def invalidate_master_cache(self):
+        """Forget the cached active master key"""
+        with self._master_lock:
+            self._master_cache = None
+            self._master_version = None
+            self._master_packed = None
+    
+    def _data_version(self):
+        """SQLite's data_version on a long-lived connection
+        
+        It changes whenever another connection (in this or any other
+        process) commits, so an unchanged value means the cache is current.
+        """
+        if self._version_conn is None or self._version_pid != os.getpid():
+            # Like the pool, a connection must not cross a fork
+            self._version_conn = self._open(check_same_thread=False)
+            self._version_pid = os.getpid()
+        return self._version_conn.execute('PRAGMA data_version').fetchone()[0]
     
     def get_active_master_key(self):
-        """Get currently active master key"""
-        conn = sqlite3.connect(self.db_path)
+        """Get currently active master key
+        
+        Served from memory while the database is unchanged. After another
+        write only the active key's id and packed answers are re-read; the
+        key is decoded again only when a different key became active or its
+        answers were corrected (in this or any other process).
+        """
+        try:
+            with self._master_lock:
+                version = self._data_version()
+                if self._master_cache is not None and version == self._master_version:
+                    return dict(self._master_cache)
+                
+                row = self._version_conn.execute('''
+                    SELECT id, answers_packed FROM master_keys
+                    WHERE is_active = 1
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ''').fetchone()
+                if row is None:
+                    master = None
+                elif (self._master_cache is not None and self._master_cache['id'] == row[0]
+                        and self._master_packed == row[1]):
+                    master = self._master_cache
+                else:
+                    master = self._load_master_key(row[0])
+                
+                self._master_cache = master
+                self._master_version = version
+                self._master_packed = row[1] if row else None
+                return dict(master) if master else None
+        except Exception as e:
+            logger.error(f"Error fetching active master key: {e}")
+            return None
+    
+    def _load_master_key(self, master_key_id):
+        """Read and decode one master key, keeping its 40-slot answer vector for grading"""
+        row = self._version_conn.execute('''
+            SELECT id, subject, grade_level, exam_date, answers_packed, layout_json
+            FROM master_keys
+            WHERE id = ?
+        ''', (master_key_id,)).fetchone()
+        if row is None:
+            return None
+        
+        return {
+            'id': row[0],
+            'subject': row[1],
+            'grade_level': row[2],
+            'exam_date': row[3],
+            'answers': answers_dict(unpack_answers(row[4])),
+            # Read-only uint8 option per question (index q - 1), 0 where unkeyed
+            'key': unpack_answers(row[4]),
+            'layout': json.loads(row[5]) if row[5] else None
+        }
+    
+    @staticmethod
+    def _grade_vector(percentages):
+        """Letter grades for an array of percentages (same bands as _calculate_grade)"""
+        bands = np.array(['F', 'D', 'C', 'B', 'A', 'A+'], dtype=object)
+        return bands[np.searchsorted([50, 60, 70, 80, 90], percentages, side='right')]
+    
+    def get_analysis_signature(self, master_key_id):
+        """(result count, packed key) of a master key, or None if unknown
+        
+        Changes whenever a result is added or the key is corrected, so it
+        tells whether a cached item analysis is still current.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT (SELECT COUNT(*) FROM grading_results WHERE master_key_id = ?), answers_packed
+                FROM master_keys WHERE id = ?
+            ''', (master_key_id, master_key_id)).fetchone()
+            return (row[0], bytes(row[1])) if row else None
+        finally:
+            self._release(conn)
+    
+    def count_results(self, master_key_id):
+        """Number of results graded against a master key"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COUNT(*) FROM grading_results WHERE master_key_id = ?', (master_key_id,)
+            ).fetchone()[0]
+        finally:
+            self._release(conn)
+    
+    def get_answer_cohort(self, master_key_id):
+        """(key vector, students x 40 answer matrix) for a master key, or None if unknown"""
+        conn = self._connect()
+        try:
+            # One read transaction, so the key and the answers are consistent
+            conn.execute('BEGIN')
+            row = conn.execute('SELECT answers_packed FROM master_keys WHERE id = ?', (master_key_id,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                'SELECT answers_packed FROM grading_results WHERE master_key_id = ? ORDER BY id', (master_key_id,)
+            ).fetchall()
+            return unpack_answers(row[0]), unpack_answer_matrix([packed for packed, in rows])
+        finally:
+            self._release(conn)
+    
+    def rescore_results(self, master_key_id, corrections=None):
+        """Recompute the scores of every result graded against a master key
+        
+        `corrections` ({question: option, or None to drop the question}) are
+        applied to the key first, in the same transaction. The stored answers
+        form one (rows x 40) matrix that is compared with the key vector in a
+        single pass. Returns the number of results rescored, or None if the
+        key does not exist or on error.
+        """
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                SELECT id, subject, grade_level, exam_date, answers_json
-                FROM master_keys
-                WHERE is_active = 1
-                ORDER BY created_at DESC
-                LIMIT 1
-            ''')
+            row = cursor.execute('SELECT answers_packed FROM master_keys WHERE id = ?', (master_key_id,)).fetchone()
+            if row is None:
+                return None
+            key = unpack_answers(row[0]).copy()
             
-            result = cursor.fetchone()
-            if result:
-                return {
-                    'id': result[0],
-                    'subject': result[1],
-                    'grade_level': result[2],
-                    'exam_date': result[3],
-                    'answers': json.loads(result[4])
-                }
+            if corrections:
+                for q, option in corrections.items():
+                    key[int(q) - 1] = option or 0
+                cursor.execute('''
+                    UPDATE master_keys SET answers_packed = ?, total_questions = ? WHERE id = ?
+                ''', (key.tobytes(), int(np.count_nonzero(key)), master_key_id))
+            
+            rows = cursor.execute(
+                'SELECT id, answers_packed FROM grading_results WHERE master_key_id = ?', (master_key_id,)
+            ).fetchall()
+            student = unpack_answer_matrix([packed for _, packed in rows])
+            
+            correct, wrong, unanswered, total, percentage = score_answer_matrix(key, student)
+            grades = self._grade_vector(percentage)
+            
+            cursor.executemany('''
+                UPDATE grading_results
+                SET total_questions = ?, correct_answers = ?, wrong_answers = ?, unanswered = ?,
+                    score = ?, percentage = ?, grade = ?
+                WHERE id = ?
+            ''', zip(
+                [total] * len(rows), correct.tolist(), wrong.tolist(), unanswered.tolist(),
+                correct.tolist(), percentage, grades.tolist(), [r[0] for r in rows]
+            ))
+            
+            conn.commit()
+            if corrections:
+                self.invalidate_master_cache()
+            logger.info(f"✓ Rescored {len(rows)} results for master key {master_key_id}")
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error rescoring results: {e}")
             return None
+        finally:
+            self._release(conn)
+    
+    def get_result_by_idempotency_key(self, idempotency_key):
+        """The result saved under an idempotency key, with its student and master key answers"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT g.student_id, s.name, g.subject, s.medium, g.grade_level, g.answers_packed,
+                       g.master_key_id, m.answers_packed
+                FROM grading_results g
+                LEFT JOIN students s ON g.student_id = s.student_id
+                LEFT JOIN master_keys m ON g.master_key_id = m.id
+                WHERE g.idempotency_key = ?
+            ''', (idempotency_key,))
+            
+            row = cursor.fetchone()
+            if row is None or row[7] is None:
+                return None
+            return {
+                'student_id': row[0],
+                'name': row[1],
+                'subject': row[2],
+                'medium': row[3],
+                'grade_level': row[4],
+                'answers': answers_dict(unpack_answers(row[5])),
+                'master_key_id': row[6],
+                'master_answers': answers_dict(unpack_answers(row[7]))
+            }
         except Exception as e:
-            logger.error(f"Error fetching active master key: {e}")
+            logger.error(f"Error fetching result for idempotency key: {e}")
             return None
         finally:
-            conn.close()
+            self._release(conn)
     
     def get_all_results(self, subject=None, grade_level=None, exam_date=None, grade=None):
         """Get all grading results with enhanced filtering"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         query = '''
@@ -305,11 +1031,11 @@ class DatabaseManager:
             logger.error(f"Error fetching results: {e}")
             return []
         finally:
-            conn.close()
+            self._release(conn)
     
     def get_results_by_subject_and_grade(self):
         """Get results grouped by subject and grade"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
@@ -345,11 +1071,11 @@ class DatabaseManager:
             logger.error(f"Error fetching grouped results: {e}")
             return {}
         finally:
-            conn.close()
+            self._release(conn)
     
     def get_available_filters(self):
         """Get available filter options"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
@@ -379,11 +1105,11 @@ class DatabaseManager:
             logger.error(f"Error fetching filters: {e}")
             return {}
         finally:
-            conn.close()
+            self._release(conn)
     
     def get_student_history(self, student_id):
         """Get grading history for a specific student"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
@@ -407,11 +1133,11 @@ class DatabaseManager:
             logger.error(f"Error fetching student history: {e}")
             return []
         finally:
-            conn.close()
+            self._release(conn)
     
     def get_statistics(self, subject=None, grade_level=None):
         """Get enhanced statistics"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         stats = {}
@@ -477,7 +1203,7 @@ class DatabaseManager:
             logger.error(f"Error fetching statistics: {e}")
             return {}
         finally:
-            conn.close()
+            self._release(conn)
 
 
 class ExcelExporter:
@@ -619,12 +1345,143 @@ class ExcelExporter:
         return True
 
 
+def decode_reduction(source):
+    """Largest power-of-two decode reduction that keeps DECODE_MIN_SIZE
+    
+    `source` is a path or file object; only the image header is read.
+    """
+    try:
+        with Image.open(source) as header:
+            long_side = max(header.size)
+    except Exception:
+        return 1
+    
+    reduction = 1
+    while reduction < 8 and long_side // (reduction * 2) >= DECODE_MIN_SIZE:
+        reduction *= 2
+    return reduction
+
+
+# Candidate bubble table used by the grid solver (one record per contour)
+CIRCLE_DTYPE = np.dtype([
+    ('x', np.int64), ('y', np.int64), ('w', np.int64), ('h', np.int64),
+    ('cx', np.int64), ('cy', np.int64),
+    ('area', np.float64),
+    ('circularity', np.float64),
+    ('marked', np.bool_),
+    ('mark_strength', np.float64),
+])
+
+
+class StageTimingStats:
+    """Thread-safe in-process aggregate of per-stage timings and peak memory"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._memory = {'count': 0, 'total': 0, 'max': 0}
+    
+    def record(self, timings):
+        """Fold one sheet's {stage: seconds} into the running totals"""
+        with self._lock:
+            for stage, seconds in timings.items():
+                entry = self._stages.get(stage)
+                if entry is None:
+                    entry = self._stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0}
+                entry['count'] += 1
+                entry['total'] += seconds
+                entry['max'] = max(entry['max'], seconds)
+    
+    def record_memory(self, peak_bytes):
+        """Fold one sheet's traced peak allocation into the running totals"""
+        with self._lock:
+            self._memory['count'] += 1
+            self._memory['total'] += peak_bytes
+            self._memory['max'] = max(self._memory['max'], peak_bytes)
+    
+    def memory_snapshot(self):
+        """Count, mean and max of the per-sheet peaks, in megabytes"""
+        with self._lock:
+            count = self._memory['count']
+            return {
+                'count': count,
+                'mean_mb': round(self._memory['total'] / count / 2**20, 2) if count else None,
+                'max_mb': round(self._memory['max'] / 2**20, 2) if count else None
+            }
+    
+    def snapshot(self):
+        """Count, mean and max per stage, in milliseconds"""
+        with self._lock:
+            return {
+                stage: {
+                    'count': entry['count'],
+                    'mean_ms': round(1000 * entry['total'] / entry['count'], 2),
+                    'max_ms': round(1000 * entry['max'], 2)
+                }
+                for stage, entry in self._stages.items()
+            }
+    
+    def reset(self):
+        """Drop all totals"""
+        with self._lock:
+            self._stages.clear()
+            self._memory = {'count': 0, 'total': 0, 'max': 0}
+
+
+stage_stats = StageTimingStats()
+
+
+def timed_stage(name):
+    """Accumulate a processor method's wall time under `name` in self.timings
+    
+    Timings are inclusive, so a stage that calls another one (answers -> grid)
+    also counts the nested stage's time. Disabled processors skip the clock.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.timings is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                # Column tiles time the same stage from several threads
+                with _timings_lock:
+                    self.timings[name] = self.timings.get(name, 0.0) + elapsed
+        return wrapper
+    return decorator
+
+
+_timings_lock = threading.Lock()
+
+
 class EnhancedOMRProcessor:
     """Production-grade OMR processor"""
     
-    def __init__(self, image_path):
+    def __init__(self, image_path=None, image=None, profile=None, osd_fallback=None,
+                 ocr_fields=HEADER_FIELDS, template=None, timings=None, lean=None,
+                 trace_memory=None, parallel_columns=None, quality_gate=None):
+        profile = profile or DEFAULT_PROFILE
+        if profile not in PROCESSING_PROFILES:
+            raise ValueError(f"Unknown processing profile: {profile}")
+        
+        self.lean = LEAN_MODE if lean is None else lean
+        self.trace_memory = TRACE_MEMORY if trace_memory is None else trace_memory
+        self.parallel_columns = PARALLEL_COLUMNS if parallel_columns is None else parallel_columns
+        self.quality_gate = QUALITY_GATE if quality_gate is None else quality_gate
+        self.quality = None
+        # (page contour, pyramid scale) found by the quality gate, if any
+        self._page_search = None
+        self.peak_memory = None
         self.image_path = image_path
-        self.original = cv2.imread(image_path)
+        self.decode_reduction = 1
+        if image is None and image_path is not None:
+            self.decode_reduction = decode_reduction(image_path)
+            flags = REDUCED_GRAYSCALE_FLAGS if self.lean else REDUCED_COLOR_FLAGS
+            image = cv2.imread(image_path, flags[self.decode_reduction])
+        self.original = image
         self.processed = None
         self.warped = None
         self.student_info = {
@@ -633,9 +1490,63 @@ class EnhancedOMRProcessor:
             'name': 'Not detected'
         }
         self.answers = {}
+        self.profile = profile
+        self.ocr_fields = set(ocr_fields or ())
+        self.osd_fallback = OSD_FALLBACK if osd_fallback is None else osd_fallback
+        self.orientation = {'angle': 0, 'method': 'none'}
+        self.escalated = False
+        self.question_margins = {}
+        self.incomplete_questions = set()
+        self.template = template
+        self.template_used = False
+        self.grid_layout = None
+        # {stage: seconds} when timing is on, None when it is off
+        self.timings = {} if (STAGE_TIMINGS if timings is None else timings) else None
+    
+    @classmethod
+    def from_bytes(cls, data, max_bytes=MAX_UPLOAD_BYTES, **kwargs):
+        """Create a processor from encoded image bytes without touching the disk
+        
+        The pipeline only needs grayscale, so the image is decoded straight to
+        one channel and, for large photos, at a reduced size.
+        """
+        if len(data) > max_bytes:
+            raise UploadTooLargeError(f"Image exceeds the {max_bytes} byte upload limit")
+        
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        reduction = decode_reduction(io.BytesIO(data)) if buffer.size else 1
+        image = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS[reduction]) if buffer.size else None
+        processor = cls(image=image, **kwargs)
+        processor.decode_reduction = reduction
+        return processor
+    
+    @staticmethod
+    def _to_gray(image):
+        """Grayscale view of a BGR or already single-channel image"""
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
     def process(self):
         """Main processing pipeline"""
+        if not self.trace_memory:
+            return self._run()
+        
+        # One traced run at a time, or runs would see each other's peaks
+        with _trace_lock:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                return self._run()
+            finally:
+                self.peak_memory = tracemalloc.get_traced_memory()[1] - base
+                if started:
+                    tracemalloc.stop()
+    
+    @timed_stage('total')
+    def _run(self):
         try:
             logger.info("="*80)
             logger.info("ENHANCED OMR PROCESSING v3.0")
@@ -644,11 +1555,40 @@ class EnhancedOMRProcessor:
             if self.original is None:
                 raise ValueError("Could not load image")
             
+            if self.lean:
+                self.original = self._to_gray(self.original)
+            if self.quality_gate:
+                self.quality = self.check_quality()
+                if self.quality['reason']:
+                    logger.warning(f"✗ Sheet rejected before processing: {self.quality['reason']}")
+                    return False
             self.processed = self._preprocess_image()
             self.warped = self._perspective_transform_robust()
-            self.student_info = self._extract_student_info()
+            if self.lean:
+                self.original = self.processed = None
+            if self.ocr_fields:
+                self.student_info = self._extract_student_info()
             self.answers = self._extract_all_40_guaranteed()
             
+            escalate_to = PROCESSING_PROFILES[self.profile]['escalate_to']
+            if escalate_to and self._needs_escalation():
+                logger.info(f"Low-confidence marks, re-running answers with '{escalate_to}' profile")
+                first_read = self._answer_state()
+                self.profile = escalate_to
+                self.escalated = True
+                self.answers = self._extract_all_40_guaranteed()
+                # The careful path is not always better (heavy denoising can
+                # wash out thin crosses), so keep whichever read is more
+                # confident, then let the other fill in the questions it read better
+                other_read = first_read
+                if self._uncertainty() >= first_read['uncertainty']:
+                    logger.info("Escalated read is not more confident, keeping the first one")
+                    other_read = self._answer_state()
+                    self._restore_answer_state(first_read)
+                self._take_confident_answers(other_read)
+            if self.lean:
+                self.warped = None
+            
             logger.info(f"✓ Processing complete: {len(self.answers)}/40 answers detected")
             return True
         except Exception as e:
@@ -657,72 +1597,280 @@ class EnhancedOMRProcessor:
             traceback.print_exc()
             return False
     
+    def _uncertainty(self):
+        """(missing or partly undetected questions, low-confidence questions); lower is better"""
+        missing = (40 - len(self.question_margins)) + len(self.incomplete_questions)
+        low_confidence = sum(
+            ESCALATION_MIN_MARGIN <= margin <= ESCALATION_MAX_MARGIN
+            for margin in self.question_margins.values()
+        )
+        return missing, low_confidence
+    
+    def _answer_state(self):
+        """Everything the answer stage sets, so an escalated run can be undone"""
+        return {
+            'uncertainty': self._uncertainty(),
+            'profile': self.profile,
+            'answers': self.answers,
+            'question_margins': self.question_margins,
+            'incomplete_questions': self.incomplete_questions,
+            'template_used': self.template_used,
+            'grid_layout': self.grid_layout,
+        }
+    
+    def _restore_answer_state(self, state):
+        for name, value in state.items():
+            if name != 'uncertainty':
+                setattr(self, name, value)
+    
+    def _take_confident_answers(self, other):
+        """Per question, adopt another read's answer where it was read with more confidence
+        
+        A fully detected row beats a partly undetected one; otherwise the
+        larger margin wins.
+        """
+        taken = 0
+        for q in map(str, range(1, 41)):
+            mine = (q not in self.incomplete_questions, self.question_margins.get(q, -1.0))
+            theirs = (q not in other['incomplete_questions'], other['question_margins'].get(q, -1.0))
+            if theirs <= mine:
+                continue
+            taken += 1
+            self.question_margins[q] = other['question_margins'][q]
+            self.incomplete_questions.discard(q)
+            if q in other['incomplete_questions']:
+                self.incomplete_questions.add(q)
+            if q in other['answers']:
+                self.answers[q] = other['answers'][q]
+            else:
+                self.answers.pop(q, None)
+        if taken:
+            logger.info(f"Took {taken} answers from the other '{other['profile']}' read")
+    
+    def unreliable_questions(self):
+        """Questions left unanswered or decided below MARK_MARGIN_THRESHOLD"""
+        return [
+            str(q) for q in range(1, 41)
+            if str(q) not in self.answers
+            or self.question_margins.get(str(q), 0.0) < MARK_MARGIN_THRESHOLD
+        ]
+    
+    def _needs_escalation(self):
+        """Check whether any question was missed, partly undetected or decided with low confidence"""
+        return self._uncertainty() != (0, 0)
+    
+    @property
+    def rejected(self):
+        """Whether the quality gate turned the sheet away"""
+        return bool(self.quality and self.quality['reason'])
+    
+    @timed_stage('quality')
+    def check_quality(self):
+        """Millisecond capture checks on a thumbnail and the page detection level
+        
+        Returns the measurements and the first failed check's reason (one of
+        QUALITY_REASONS), or None as the reason when the sheet looks usable.
+        """
+        # The page is searched for exactly as the perspective stage would, and
+        # that stage reuses the result
+        small, scale = self._page_detect_level(self._to_gray(self.original))
+        quad = self._search_page_quad(small)
+        self._page_search = (quad, scale)
+        
+        factor = QUALITY_THUMB_SIZE / float(max(small.shape[:2]))
+        thumb = small
+        if factor < 1:
+            thumb = cv2.resize(small, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        
+        sharpness = float(cv2.Laplacian(thumb, cv2.CV_64F).var())
+        
+        page = np.full(thumb.shape, 255, dtype=np.uint8)
+        if quad is not None:
+            page[:] = 0
+            corners = np.round(quad.reshape(4, 2) * min(factor, 1.0)).astype(np.int32)
+            cv2.fillConvexPoly(page, corners, 255)
+        on_page = page > 0
+        
+        # Darkest pixel around each point: clipped means no ink in the window
+        window = np.ones((QUALITY_GLARE_WINDOW, QUALITY_GLARE_WINDOW), np.uint8)
+        washed = (cv2.erode(thumb, window) >= QUALITY_CLIP_LEVEL) & on_page
+        glare = np.count_nonzero(washed) / float(max(1, np.count_nonzero(on_page)))
+        paper_level = float(np.median(thumb[on_page]))
+        
+        reason = None
+        if sharpness < QUALITY_MIN_SHARPNESS:
+            reason = 'blurry'
+        elif quad is None:
+            reason = 'no_page'
+        elif glare > QUALITY_MAX_GLARE and paper_level < QUALITY_CLIP_LEVEL:
+            reason = 'glare'
+        
+        return {
+            'reason': reason,
+            'sharpness': round(sharpness, 1),
+            'glare': round(float(glare), 3),
+            'page_found': quad is not None
+        }
+    
+    @timed_stage('denoise')
+    def _denoise(self, gray):
+        """Denoise a grayscale region with the active profile's filter"""
+        method = PROCESSING_PROFILES[self.profile]['denoise']
+        if method == 'median':
+            return cv2.medianBlur(gray, 3)
+        if method == 'bilateral':
+            return cv2.bilateralFilter(gray, 7, 50, 50)
+        return cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+    
+    @timed_stage('preprocess')
     def _preprocess_image(self):
         """Preprocess with rotation detection"""
-        img = self.original.copy()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img = self.original
+        gray = self._to_gray(img)
+        
+        angle, method = self._detect_orientation(gray), 'geometry'
+        if angle is None and self.osd_fallback:
+            angle, method = self._detect_orientation_osd(gray), 'osd'
+        if angle is None:
+            angle, method = 0, 'none'
+        
+        self.orientation = {'angle': angle, 'method': method}
+        if angle in ROTATION_FIXES:
+            img = cv2.rotate(img, ROTATION_FIXES[angle])
+            self._page_search = None
+            logger.info(f"Rotated: {angle}° ({method})")
+        else:
+            logger.info(f"Orientation: upright ({method})")
+        
+        return img
+    
+    @timed_stage('orientation')
+    def _detect_orientation(self, gray):
+        """Detect 0/90/180/270 rotation from the bubble grid on a thumbnail
+        
+        Answer rows hold 16 bubbles and columns only 10, which separates
+        upright from sideways pages; question numbers sit left of each
+        4-bubble group, which separates upright from upside down.
+        """
+        scale = ORIENTATION_THUMB_SIZE / max(gray.shape[:2])
+        if scale < 1:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                       cv2.THRESH_BINARY_INV, 21, 10)
+        
+        bubbles = self._find_bubble_centers(binary)
+        if len(bubbles) < 20:
+            return None
+        
+        d = np.median(bubbles[:, 2])
+        dx = np.abs(bubbles[None, :, 0] - bubbles[:, None, 0])
+        dy = np.abs(bubbles[None, :, 1] - bubbles[:, None, 1])
+        same_row = np.median(((dy < 0.5 * d) & (dx > 0.5 * d)).sum(axis=1))
+        same_col = np.median(((dx < 0.5 * d) & (dy > 0.5 * d)).sum(axis=1))
+        if same_row == same_col:
+            return None
+        
+        sideways = same_col > same_row
+        if sideways:
+            binary = cv2.rotate(binary, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            bubbles = self._find_bubble_centers(binary)
+            if len(bubbles) < 20:
+                return None
+        
+        score = self._label_side_score(binary, bubbles)
+        if abs(score) < 0.02:
+            return None
+        
+        angle = 90 if sideways else 0
+        return angle if score > 0 else angle + 180
+    
+    def _find_bubble_centers(self, binary):
+        """Find (cx, cy, diameter) of bubble-like outer contours"""
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            return np.zeros((0, 3))
+        
+        bubbles = []
+        for cnt, (_, _, _, parent) in zip(contours, hierarchy[0]):
+            if parent != -1:
+                continue
+            area = cv2.contourArea(cnt)
+            if area < 20:
+                continue
+            x, y, w, h = cv2.boundingRect(cnt)
+            if not 0.7 < w / h < 1.4:
+                continue
+            peri = cv2.arcLength(cnt, True)
+            if peri == 0 or 4 * np.pi * area / (peri * peri) < 0.5:
+                continue
+            bubbles.append((x + w / 2.0, y + h / 2.0, (w + h) / 2.0))
         
-        # Try rotation detection if Tesseract is available
+        if not bubbles:
+            return np.zeros((0, 3))
+        bubbles = np.array(bubbles)
+        d = np.median(bubbles[:, 2])
+        return bubbles[(bubbles[:, 2] > 0.75 * d) & (bubbles[:, 2] < 1.3 * d)]
+    
+    def _label_side_score(self, binary, bubbles):
+        """Ink left of each bubble group minus ink right of it (positive when upright)"""
+        d = np.median(bubbles[:, 2])
+        dx = bubbles[None, :, 0] - bubbles[:, None, 0]
+        same_row = np.abs(bubbles[None, :, 1] - bubbles[:, None, 1]) < 0.5 * d
+        right_gap = np.where(same_row & (dx > 0.5 * d), dx, np.inf).min(axis=1)
+        left_gap = np.where(same_row & (dx < -0.5 * d), -dx, np.inf).min(axis=1)
+        nearest = np.minimum(left_gap, right_gap)
+        if not np.isfinite(nearest).any():
+            return 0.0
+        pitch = np.median(nearest[np.isfinite(nearest)])
+        
+        def ink(x1, x2, cy):
+            y1, y2 = int(max(0, cy - 0.4 * d)), int(min(binary.shape[0], cy + 0.4 * d))
+            x1, x2 = int(max(0, x1)), int(min(binary.shape[1], x2))
+            if x2 <= x1 or y2 <= y1:
+                return 0.0
+            return np.count_nonzero(binary[y1:y2, x1:x2]) / float((x2 - x1) * (y2 - y1))
+        
+        # Strips one bubble wide, just clear of the bubble outline
+        edge = 0.65 * d
+        left = [ink(cx - edge - d, cx - edge, cy) for cx, cy, _ in bubbles[left_gap > 1.6 * pitch]]
+        right = [ink(cx + edge, cx + edge + d, cy) for cx, cy, _ in bubbles[right_gap > 1.6 * pitch]]
+        if not left or not right:
+            return 0.0
+        return float(np.mean(left) - np.mean(right))
+    
+    @timed_stage('osd')
+    def _detect_orientation_osd(self, gray):
+        """Detect rotation with Tesseract OSD (slow; opt-in fallback)"""
         try:
             osd = pytesseract.image_to_osd(gray)
             angle_match = re.search(r'Rotate: (\d+)', osd)
-            
             if angle_match:
-                angle = int(angle_match.group(1))
-                if angle == 90:
-                    img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                elif angle == 180:
-                    img = cv2.rotate(img, cv2.ROTATE_180)
-                elif angle == 270:
-                    img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
-                logger.info(f"Rotated: {angle}°")
-        except:
-            logger.info("Rotation detection skipped")
-        
-        return img
+                return int(angle_match.group(1))
+        except Exception as e:
+            logger.info(f"OSD rotation detection skipped: {e}")
+        return None
     
+    @timed_stage('perspective')
     def _perspective_transform_robust(self):
-        """Robust perspective correction"""
-        gray = cv2.cvtColor(self.processed, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        """Robust perspective correction
         
-        methods = [(50, 150), (30, 100), (75, 200)]
+        The page quad is searched for on a downscaled pyramid level, its
+        corners are refined at full resolution, and the sheet is warped once
+        to CANONICAL_SHEET_WIDTH.
+        """
+        gray = self._to_gray(self.processed)
         
-        best_contour = None
-        best_area = 0
-        img_area = self.processed.shape[0] * self.processed.shape[1]
+        quad = self._find_page_quad(gray)
         
-        for low, high in methods:
-            edged = cv2.Canny(blurred, low, high)
-            kernel = np.ones((5, 5), np.uint8)
-            dilated = cv2.dilate(edged, kernel, iterations=2)
-            
-            contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            contours = sorted(contours, key=cv2.contourArea, reverse=True)
-            
-            for contour in contours[:15]:
-                peri = cv2.arcLength(contour, True)
-                approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-                
-                if len(approx) == 4:
-                    area = cv2.contourArea(approx)
-                    
-                    if area > img_area * 0.3 and area > best_area:
-                        best_contour = approx
-                        best_area = area
-        
-        if best_contour is not None:
-            pts = best_contour.reshape(4, 2).astype('float32')
-            rect = self._order_points(pts)
+        if quad is not None:
+            rect = self._order_points(quad)
             
             (tl, tr, br, bl) = rect
-            widthA = np.linalg.norm(br - bl)
-            widthB = np.linalg.norm(tr - tl)
-            maxWidth = max(int(widthA), int(widthB))
+            quad_width = max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl))
+            quad_height = max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl))
             
-            heightA = np.linalg.norm(tr - br)
-            heightB = np.linalg.norm(tl - bl)
-            maxHeight = max(int(heightA), int(heightB))
+            maxWidth = CANONICAL_SHEET_WIDTH
+            maxHeight = int(round(CANONICAL_SHEET_WIDTH * quad_height / quad_width))
             
             dst = np.array([
                 [0, 0],
@@ -734,7 +1882,7 @@ class EnhancedOMRProcessor:
             M = cv2.getPerspectiveTransform(rect, dst)
             warped = cv2.warpPerspective(self.processed, M, (maxWidth, maxHeight))
             
-            logger.info(f"✓ Perspective corrected: {maxWidth}x{maxHeight}")
+            logger.info(f"✓ Perspective corrected: {int(quad_width)}x{int(quad_height)} -> {maxWidth}x{maxHeight}")
             return warped
         
         # Fallback with safer padding
@@ -748,7 +1896,7 @@ class EnhancedOMRProcessor:
         x_indices = np.where(cols_with_content)[0]
         
         if len(y_indices) > 0 and len(x_indices) > 0:
-            pad = 150 # Large padding to ensure edge blanks aren't cut
+            pad = 150 // self.decode_reduction # Large padding to ensure edge blanks aren't cut
             y1 = max(0, y_indices[0] - pad)
             y2 = min(self.processed.shape[0], y_indices[-1] + pad)
             x1 = max(0, x_indices[0] - pad)
@@ -756,7 +1904,7 @@ class EnhancedOMRProcessor:
             
             cropped = self.processed[y1:y2, x1:x2]
             
-            target_width = 1200
+            target_width = CANONICAL_SHEET_WIDTH
             aspect = cropped.shape[0] / cropped.shape[1]
             target_height = int(target_width * aspect)
             
@@ -764,7 +1912,95 @@ class EnhancedOMRProcessor:
             logger.info(f"✓ Intelligent crop: {target_width}x{target_height}")
             return resized
         
-        return cv2.resize(self.processed, (1200, 1600))
+        return cv2.resize(self.processed, (CANONICAL_SHEET_WIDTH, CANONICAL_SHEET_WIDTH * 4 // 3))
+    
+    def _find_page_quad(self, gray):
+        """Find the page quad on a pyramid level, refined at full resolution"""
+        if self._page_search is not None:
+            # The quality gate already searched this (unrotated) image
+            best_contour, scale = self._page_search
+        else:
+            small, scale = self._page_detect_level(gray)
+            best_contour = self._search_page_quad(small)
+        if best_contour is None:
+            return None
+        
+        corners = best_contour.reshape(4, 2).astype('float32') * scale
+        if scale == 1:
+            # Detected at full resolution; nothing was lost to downscaling
+            return corners
+        return self._refine_corners(gray, corners, scale)
+    
+    @staticmethod
+    def _page_detect_level(gray):
+        """Smallest pyramid level at least PAGE_DETECT_SIZE, and its scale"""
+        small = gray
+        scale = 1
+        while max(small.shape[:2]) >= 2 * PAGE_DETECT_SIZE:
+            small = cv2.pyrDown(small)
+            scale *= 2
+        return small, scale
+    
+    @staticmethod
+    def _search_page_quad(small):
+        """Largest 4-corner contour covering at least 30% of the image, or None"""
+        blurred = cv2.GaussianBlur(small, (5, 5), 0)
+        kernel = np.ones((5, 5), np.uint8)
+        
+        methods = [(50, 150), (30, 100), (75, 200)]
+        
+        best_contour = None
+        best_area = 0
+        img_area = small.shape[0] * small.shape[1]
+        
+        for low, high in methods:
+            edged = cv2.Canny(blurred, low, high)
+            dilated = cv2.dilate(edged, kernel, iterations=2)
+            
+            contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours = sorted(contours, key=cv2.contourArea, reverse=True)
+            
+            for contour in contours[:15]:
+                peri = cv2.arcLength(contour, True)
+                approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+                
+                if len(approx) == 4:
+                    area = cv2.contourArea(approx)
+                    
+                    if area > img_area * 0.3 and area > best_area:
+                        best_contour = approx
+                        best_area = area
+            
+            # A quad covering most of the frame will not be beaten by another pass
+            if best_area > img_area * PAGE_EARLY_EXIT_FRACTION:
+                break
+        
+        return best_contour
+    
+    def _refine_corners(self, gray, corners, scale):
+        """Refine coarse corners with sub-pixel search in small full-res windows"""
+        half = 4 * scale + 4
+        refined = corners.copy()
+        
+        for i, (x, y) in enumerate(corners):
+            x0 = int(min(max(x - 2 * half, 0), gray.shape[1] - 1))
+            y0 = int(min(max(y - 2 * half, 0), gray.shape[0] - 1))
+            patch = gray[y0:int(y + 2 * half) + 1, x0:int(x + 2 * half) + 1]
+            if patch.shape[0] < 2 * half + 3 or patch.shape[1] < 2 * half + 3:
+                continue
+            
+            point = np.array([[[x - x0, y - y0]]], dtype='float32')
+            point[..., 0] = np.clip(point[..., 0], half + 1, patch.shape[1] - half - 2)
+            point[..., 1] = np.clip(point[..., 1], half + 1, patch.shape[0] - half - 2)
+            cv2.cornerSubPix(patch, point, (half, half), (-1, -1),
+                             (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.1))
+            
+            candidate = point[0, 0] + (x0, y0)
+            # Only trust refinements that stay near the coarse estimate
+            if np.linalg.norm(candidate - corners[i]) <= half:
+                refined[i] = candidate
+        
+        return refined
     
     def _order_points(self, pts):
         """Order corner points"""
@@ -777,90 +2013,194 @@ class EnhancedOMRProcessor:
         rect[3] = pts[np.argmax(diff)]
         return rect
     
+    @timed_stage('ocr')
     def _extract_student_info(self):
-        """Extract student information"""
+        """Extract the requested header fields with a single OCR call"""
+        info = {'subject': 'Not detected', 'medium': 'Not detected', 'name': 'Not detected'}
+        fields = [f for f in HEADER_FIELD_BOUNDS if f in self.ocr_fields]
+        if not fields:
+            return info
+        
         height, width = self.warped.shape[:2]
         header = self.warped[0:int(height * 0.20), :]
-        gray = cv2.cvtColor(header, cv2.COLOR_BGR2GRAY)
-        
-        info = {'subject': 'Not detected', 'medium': 'Not detected', 'name': 'Not detected'}
+        gray = self._to_gray(header)
         
         try:
-            denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+            denoised = self._denoise(gray)
             clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
             enhanced = clahe.apply(denoised)
             _, thresh = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
             thresh_inv = cv2.bitwise_not(thresh)
             
-            # Subject
-            sub_y1, sub_y2 = int(height * 0.08), int(height * 0.18)
-            sub_x1, sub_x2 = int(width * 0.10), int(width * 0.30)
-            sub_region = thresh_inv[sub_y1:sub_y2, sub_x1:sub_x2]
-            
-            if sub_region.size > 0:
-                sub_region = cv2.resize(sub_region, None, fx=3, fy=3)
-                text = pytesseract.image_to_string(sub_region, lang='eng', config='--psm 7').strip()
-                if text and len(text) > 1:
-                    info['subject'] = ' '.join(text.split())
-            
-            # Medium
-            med_x1, med_x2 = int(width * 0.40), int(width * 0.55)
-            med_region = thresh_inv[sub_y1:sub_y2, med_x1:med_x2]
-            
-            if med_region.size > 0:
-                med_region = cv2.resize(med_region, None, fx=3, fy=3)
-                text = pytesseract.image_to_string(med_region, lang='eng', config='--psm 7').strip()
-                lower = text.lower()
-                if 'eng' in lower:
-                    info['medium'] = 'English'
-                elif 'sinh' in lower or 'sinhala' in lower:
-                    info['medium'] = 'Sinhala'
-                elif 'tamil' in lower:
-                    info['medium'] = 'Tamil'
-            
-            # Name
-            name_x1, name_x2 = int(width * 0.58), int(width * 0.95)
-            name_region = thresh_inv[sub_y1:sub_y2, name_x1:name_x2]
-            
-            if name_region.size > 0:
-                name_region = cv2.resize(name_region, None, fx=3, fy=3)
-                text = pytesseract.image_to_string(name_region, lang='eng', config='--psm 7').strip()
-                if text and len(text) > 2:
-                    info['name'] = ' '.join(text.split()).replace('|', '').replace('_', '')
+            y1, y2 = int(height * 0.08), int(height * 0.18)
+            crops = []
+            for field in fields:
+                x1, x2 = (int(width * f) for f in HEADER_FIELD_BOUNDS[field])
+                region = thresh_inv[y1:y2, x1:x2]
+                if region.size > 0:
+                    crops.append((field, cv2.resize(region, None, fx=3, fy=3)))
+            
+            texts = self._ocr_fields(crops)
+            
+            text = texts.get('subject', '')
+            if text and len(text) > 1:
+                info['subject'] = ' '.join(text.split())
+            
+            lower = texts.get('medium', '').lower()
+            if 'eng' in lower:
+                info['medium'] = 'English'
+            elif 'sinh' in lower or 'sinhala' in lower:
+                info['medium'] = 'Sinhala'
+            elif 'tamil' in lower:
+                info['medium'] = 'Tamil'
+            
+            text = texts.get('name', '')
+            if text and len(text) > 2:
+                info['name'] = ' '.join(text.split()).replace('|', '').replace('_', '')
         
         except Exception as e:
             logger.warning(f"OCR extraction skipped: {e}")
         
         return info
     
+    def _ocr_fields(self, crops):
+        """OCR several single-line crops in one Tesseract call
+        
+        Crops are stacked into one composite image and each recognized word
+        is mapped back to the crop whose band contains it.
+        """
+        if not crops:
+            return {}
+        
+        gap = 30
+        composite = np.zeros((
+            sum(crop.shape[0] for _, crop in crops) + gap * (len(crops) + 1),
+            max(crop.shape[1] for _, crop in crops)
+        ), dtype=np.uint8)
+        
+        bands = []
+        top = gap
+        for field, crop in crops:
+            h, w = crop.shape[:2]
+            composite[top:top + h, :w] = crop
+            bands.append((field, top - gap / 2.0, top + h + gap / 2.0))
+            top += h + gap
+        
+        data = pytesseract.image_to_data(composite, lang='eng', config='--psm 6',
+                                         output_type=pytesseract.Output.DICT)
+        
+        words = defaultdict(list)
+        for text, left, word_top, word_height in zip(data['text'], data['left'], data['top'], data['height']):
+            if not text.strip():
+                continue
+            middle = word_top + word_height / 2.0
+            for field, band_top, band_bottom in bands:
+                if band_top <= middle < band_bottom:
+                    words[field].append((left, text.strip()))
+                    break
+        
+        return {field: ' '.join(text for _, text in sorted(ws)) for field, ws in words.items()}
+    
+    @timed_stage('answers')
     def _extract_all_40_guaranteed(self):
         """Extract all 40 answers"""
         height, width = self.warped.shape[:2]
         answer_area = self.warped[int(height * 0.20):int(height * 0.97), :]
         ans_height, ans_width = answer_area.shape[:2]
         
-        gray = cv2.cvtColor(answer_area, cv2.COLOR_BGR2GRAY)
-        denoised = cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+        gray = self._to_gray(answer_area)
+        if self.parallel_columns:
+            cleaned = self._binarize_tiled(gray, self._column_tiles(ans_width, COLUMN_FILTER_PAD))
+        else:
+            cleaned = self._binarize(gray)
+        
+        if self.template:
+            answers = self._extract_with_template(gray, cleaned, ans_width, ans_height)
+            if answers is not None:
+                return answers
+            logger.info("Template fit too poor, falling back to full grid detection")
+        
+        if self.parallel_columns:
+            all_circles = np.concatenate(list(get_column_pool().map(
+                lambda tile: self._find_candidates(gray, cleaned, tile),
+                self._column_tiles(ans_width, COLUMN_CONTOUR_PAD)
+            )))
+        else:
+            all_circles = self._find_candidates(gray, cleaned, (0, ans_width, 0, ans_width))
+        logger.info(f"Detected {len(all_circles)} potential circles")
+        logger.info(f"Marked circles: {int(np.count_nonzero(all_circles['marked']))}")
         
-        adaptive = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                        cv2.THRESH_BINARY_INV, 15, 3)
+        answers = self._extract_with_grid_system(all_circles, ans_width, ans_height)
+        
+        return answers
+    
+    @staticmethod
+    def _column_tiles(width, pad):
+        """(x0, x1, core_x0, core_x1) of each column strip, overlapping by `pad`"""
+        bounds = [int(round(i * width / COLUMN_TILES)) for i in range(COLUMN_TILES + 1)]
+        return [
+            (max(0, c0 - pad), min(width, c1 + pad), c0, c1)
+            for c0, c1 in zip(bounds, bounds[1:])
+        ]
+    
+    def _binarize(self, gray):
+        """Denoised, thresholded and cleaned ink mask of the answer area"""
+        denoised = self._denoise(gray)
         _, otsu = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return self._threshold(denoised, otsu)
+    
+    def _binarize_tiled(self, gray, tiles):
+        """_binarize() run per column strip in the column pool
+        
+        Otsu's threshold is still picked on the whole area, between the
+        denoising and thresholding passes, so all strips share it.
+        """
+        pool = get_column_pool()
+        denoised = np.empty_like(gray)
+        cleaned = np.empty_like(gray)
+        
+        def denoise(tile):
+            x0, x1, c0, c1 = tile
+            denoised[:, c0:c1] = self._denoise(gray[:, x0:x1])[:, c0 - x0:c1 - x0]
+        
+        def threshold(tile):
+            x0, x1, c0, c1 = tile
+            strip = self._threshold(denoised[:, x0:x1], otsu[:, x0:x1])
+            cleaned[:, c0:c1] = strip[:, c0 - x0:c1 - x0]
+        
+        list(pool.map(denoise, tiles))
+        _, otsu = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        list(pool.map(threshold, tiles))
+        return cleaned
+    
+    @staticmethod
+    def _threshold(denoised, otsu):
+        """Combine adaptive and Otsu thresholds and remove speckle"""
+        adaptive = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                        cv2.THRESH_BINARY_INV, ANSWER_THRESHOLD_BLOCK, 3)
         combined = cv2.bitwise_or(adaptive, otsu)
         
         kernel = np.ones((2, 2), np.uint8)
         cleaned = cv2.morphologyEx(combined, cv2.MORPH_OPEN, kernel)
-        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel)
-        
-        contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel)
+    
+    def _find_candidates(self, gray, binary, tile):
+        """Scored bubble candidates whose centre lies in the tile's core strip"""
+        x0, x1, c0, c1 = tile
+        contours, _ = cv2.findContours(binary[:, x0:x1], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        all_circles = []
+        candidates = []
         for cnt in contours:
             area = cv2.contourArea(cnt)
             
-            if area < 80 or area > 5000:
+            if area < BUBBLE_MIN_AREA or area > BUBBLE_MAX_AREA:
                 continue
             
             x, y, w, h = cv2.boundingRect(cnt)
+            x += x0
+            if not c0 <= x + w // 2 < c1:
+                continue
+            
             aspect_ratio = w / float(h) if h > 0 else 0
             if aspect_ratio < 0.5 or aspect_ratio > 2.0:
                 continue
@@ -873,37 +2213,193 @@ class EnhancedOMRProcessor:
             if circularity < 0.3:
                 continue
             
-            cx = x + w // 2
-            cy = y + h // 2
-            
-            all_circles.append({
-                'x': x, 'y': y, 'w': w, 'h': h,
-                'cx': cx, 'cy': cy,
-                'area': area,
-                'circularity': circularity,
-                'marked': False,
-                'mark_strength': 0.0
-            })
+            candidates.append((x, y, w, h, x + w // 2, y + h // 2, area, circularity, False, 0.0))
         
-        logger.info(f"Detected {len(all_circles)} potential circles")
+        circles = np.array(candidates, dtype=CIRCLE_DTYPE)
+        circles['marked'], circles['mark_strength'] = self._score_candidates(
+            gray, binary, circles['x'], circles['y'], circles['w'], circles['h']
+        )
+        return circles
+    
+    @timed_stage('template')
+    def _extract_with_template(self, gray, binary, img_width, img_height):
+        """Sample bubbles directly at the master key's layout
+        
+        The template is aligned by searching a small shift that maximizes ink
+        on the printed bubble outlines. Returns None when the best fit is too
+        weak to trust, so the caller can run full grid detection instead.
+        """
+        layout = self.template
+        bw = max(int(round(layout['bubble_w'] * img_width)), 8)
+        bh = max(int(round(layout['bubble_h'] * img_height)), 8)
+        
+        # Bubble centres in question order: column, row, option
+        slot_x = np.array(layout['slots'], dtype=np.float64) * img_width
+        anchor_y = np.array(layout['y_anchors'], dtype=np.float64) * img_height
+        cx = np.broadcast_to(slot_x[:, None, :], (4, 10, 4)).ravel()
+        cy = np.broadcast_to(anchor_y[None, :, None], (4, 10, 4)).ravel()
+        
+        # Fraction of each bubble outline that lands on ink, for every candidate
+        # centre at once; computed at half resolution, which is plenty to align
+        ink = cv2.resize(cv2.dilate(binary, np.ones((3, 3), np.uint8)), None, fx=0.5, fy=0.5,
+                         interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+        rw, rh = bw // 2, bh // 2
+        ring = np.zeros((2 * (rh // 2) + 1, 2 * (rw // 2) + 1), dtype=np.uint8)
+        cv2.ellipse(ring, (rw // 2, rh // 2), (rw // 2, rh // 2), 0, 0, 360, 1, 2)
+        ring = ring.astype(np.float32) / ring.sum()
+        response = cv2.filter2D(ink, -1, ring, borderType=cv2.BORDER_CONSTANT)
+        
+        def fit(x, y, reach):
+            """Ring response for each centre at every shift within reach"""
+            shifts = np.arange(-reach, reach + 1)
+            px = x[:, None, None] + shifts[None, None, :]
+            py = y[:, None, None] + shifts[None, :, None]
+            inside = (px >= 0) & (px < ink.shape[1]) & (py >= 0) & (py < ink.shape[0])
+            return shifts, np.where(inside, response[np.clip(py, 0, ink.shape[0] - 1),
+                                                     np.clip(px, 0, ink.shape[1] - 1)], 0)
+        
+        # Best global offset, then let each bubble settle on its own outline
+        # to absorb what is left of the perspective warp
+        hx, hy = np.rint(cx / 2).astype(np.int64), np.rint(cy / 2).astype(np.int64)
+        shifts, fits = fit(hx, hy, int(max(rw, rh) * TEMPLATE_SEARCH_RADIUS))
+        iy, ix = np.unravel_index(np.argmax(fits.mean(axis=0)), fits.shape[1:])
+        shift_x, shift_y = int(shifts[ix]), int(shifts[iy])
+        
+        # Judge the fit by its weakest row and slot track, so a template that
+        # locked onto the neighbouring row (one row falls off the grid) fails
+        fit_at = fits[:, iy, ix].reshape(4, 10, 4)
+        score = float(min(fit_at.mean(axis=(0, 2)).min(), fit_at.mean(axis=1).min()))
+        
+        if score < TEMPLATE_MIN_FIT:
+            logger.info(f"Template fit: {score:.2f} (below {TEMPLATE_MIN_FIT})")
+            return None
         
-        for c in all_circles:
-            is_marked, strength = self._is_marked_advanced(gray, cleaned, c)
-            c['marked'] = is_marked
-            c['mark_strength'] = strength
+        hx, hy = hx + shift_x, hy + shift_y
+        shifts, local = fit(hx, hy, max(min(rw, rh) // 4, 1))
+        best = np.argmax(local.reshape(len(hx), -1), axis=1)
+        # A half-resolution pixel covers two full-resolution ones: map to the second.
+        # Boxes are a pixel under the median size so the sampled disk stays inside
+        # the printed outline of bubbles that came out slightly small.
+        sw, sh = bw - 1, bh - 1
+        xs = 2 * (hx + shifts[best % len(shifts)]) + 1 - sw // 2
+        ys = 2 * (hy + shifts[best // len(shifts)]) + 1 - sh // 2
+        _, strengths = self._score_candidates(gray, binary, xs, ys,
+                                              np.full(len(xs), sw), np.full(len(xs), sh))
+        strengths = np.maximum(strengths.reshape(40, 4), 0.05)
         
-        marked_count = sum(1 for c in all_circles if c['marked'])
-        logger.info(f"Marked circles: {marked_count}")
+        answers = {}
+        self.question_margins = {}
+        self.incomplete_questions = set()
+        margins = strengths.max(axis=1) - strengths.sum(axis=1) / 4.0
+        for q in range(40):
+            self.question_margins[str(q + 1)] = float(margins[q])
+            if margins[q] > MARK_MARGIN_THRESHOLD:
+                answers[str(q + 1)] = int(np.argmax(strengths[q])) + 1
+        
+        self.template_used = True
+        logger.info(f"✓ Template fit: {score:.2f} at offset ({2 * shift_x}, {2 * shift_y})")
+        return answers
+    
+    # Pixel offsets of cv2's filled circle, keyed by radius
+    _disk_offsets_cache = {}
+    
+    @classmethod
+    def _disk_offsets(cls, radius):
+        """Get (dy, dx) offsets of the pixels cv2.circle fills for a radius"""
+        offsets = cls._disk_offsets_cache.get(radius)
+        if offsets is None:
+            canvas = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+            cv2.circle(canvas, (radius, radius), radius, 255, -1)
+            dy, dx = np.nonzero(canvas)
+            offsets = (dy - radius, dx - radius)
+            cls._disk_offsets_cache[radius] = offsets
+        return offsets
+    
+    def _score_candidates(self, gray, binary, xs, ys, ws, hs):
+        """Batched mark detection for all candidates in one vectorized pass
+        
+        Produces the same (marked, mark_strength) values as calling
+        _is_marked_advanced() on every candidate, without per-bubble masks.
+        """
+        n = len(xs)
+        marked = np.zeros(n, dtype=bool)
+        strengths = np.zeros(n, dtype=np.float64)
+        if n == 0:
+            return marked, strengths
+        
+        pad = MARK_ROI_PAD
+        x1 = np.maximum(0, xs - pad)
+        y1 = np.maximum(0, ys - pad)
+        x2 = np.minimum(binary.shape[1], xs + ws + pad)
+        y2 = np.minimum(binary.shape[0], ys + hs + pad)
+        
+        # Disk centre sits at a fixed offset from the (clipped) ROI origin
+        cx = x1 + ws // 2 + pad
+        cy = y1 + hs // 2 + pad
+        radius = np.minimum(ws, hs) // 2 - 2
+        valid = (radius >= 3) & (x2 > x1) & (y2 > y1)
+        
+        # Gather every in-ROI disk pixel of every candidate, labelled by candidate
+        labels, rows, cols = [], [], []
+        for r in np.unique(radius[valid]):
+            sel = np.flatnonzero(valid & (radius == r))
+            dy, dx = self._disk_offsets(int(r))
+            py = cy[sel, None] + dy[None, :]
+            px = cx[sel, None] + dx[None, :]
+            inside = (
+                (px >= x1[sel, None]) & (px < x2[sel, None]) &
+                (py >= y1[sel, None]) & (py < y2[sel, None])
+            )
+            labels.append(np.broadcast_to(sel[:, None], py.shape)[inside])
+            rows.append(py[inside])
+            cols.append(px[inside])
+        
+        if not labels:
+            return marked, strengths
+        
+        labels = np.concatenate(labels)
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        
+        values = gray[rows, cols].astype(np.float64)
+        filled = (binary[rows, cols] > 0).astype(np.float64)
+        
+        counts = np.bincount(labels, minlength=n)
+        has_pixels = counts > 0
+        safe_counts = np.maximum(counts, 1)
+        
+        fill_ratio = np.bincount(labels, weights=filled, minlength=n) / safe_counts
+        avg_intensity = np.bincount(labels, weights=values, minlength=n) / safe_counts
+        deviation = values - avg_intensity[labels]
+        std_intensity = np.sqrt(np.bincount(labels, weights=deviation * deviation, minlength=n) / safe_counts)
+        min_intensity = np.full(n, 255.0)
+        np.minimum.at(min_intensity, labels, values)
+        
+        marked = (
+            ((fill_ratio > 0.40) & (avg_intensity < 150)) |
+            (min_intensity < 100) |
+            ((fill_ratio > 0.50) & (avg_intensity < 170)) |
+            ((fill_ratio > 0.35) & (avg_intensity < 140) & (std_intensity < 35)) |
+            # Relaxed checks for 'X' marks which average ~205 intensity but have solid minimum dips
+            ((fill_ratio > 0.35) & (avg_intensity < 215)) |
+            ((min_intensity < 185) & (fill_ratio > 0.30))
+        ) & has_pixels
         
-        answers = self._extract_with_grid_system(all_circles, ans_width, ans_height)
+        intensity_score = (255 - avg_intensity) / 255.0
+        darkness_score = (255 - min_intensity) / 255.0
+        strengths = np.where(
+            has_pixels,
+            intensity_score * 0.3 + fill_ratio * 0.4 + darkness_score * 0.3,
+            0.0
+        )
         
-        return answers
+        return marked, strengths
     
     def _is_marked_advanced(self, gray, binary, circle):
         """Advanced mark detection"""
         x, y, w, h = circle['x'], circle['y'], circle['w'], circle['h']
         
-        pad = 3
+        pad = MARK_ROI_PAD
         x1 = max(0, x - pad)
         y1 = max(0, y - pad)
         x2 = min(binary.shape[1], x + w + pad)
@@ -963,114 +2459,132 @@ class EnhancedOMRProcessor:
         strength = (intensity_score * 0.3 + fill_score * 0.4 + darkness_score * 0.3)
         
         return is_marked, strength
+    @timed_stage('grid')
     def _extract_with_grid_system(self, all_circles, img_width, img_height):
-        """Final OMR Strategy: Strict Quad-Column Density Filter for 100% Accuracy"""
+        """Final OMR Strategy: Strict Quad-Column Density Filter for 100% Accuracy
+        
+        all_circles is a CIRCLE_DTYPE structured array; every step below works
+        on whole columns of it rather than on per-bubble Python objects.
+        """
         answers = {}
+        self.question_margins = {}
+        self.incomplete_questions = set()
         
         # 1. Bubble size and Height Filtering
-        all_areas = [c['area'] for c in all_circles]
-        if not all_areas: return answers
-        median_area = np.median(all_areas)
-        good_bubbles = [c for c in all_circles if (0.6 * median_area < c['area'] < 1.4 * median_area) and (img_height * 0.05 < c['cy'] < img_height * 0.98)]
-        if not good_bubbles: return answers
+        if len(all_circles) == 0: return answers
+        median_area = np.median(all_circles['area'])
+        keep = (
+            (0.6 * median_area < all_circles['area']) & (all_circles['area'] < 1.4 * median_area) &
+            (img_height * 0.05 < all_circles['cy']) & (all_circles['cy'] < img_height * 0.98)
+        )
+        good_bubbles = all_circles[keep]
+        if len(good_bubbles) == 0: return answers
+        cx = good_bubbles['cx'].astype(np.float64)
+        cy = good_bubbles['cy'].astype(np.float64)
         
         # 2. Robust Column Separation using Inter-Column Gaps
-        cx_v = sorted([b['cx'] for b in good_bubbles])
-        gaps = sorted([(cx_v[i+1] - cx_v[i], i) for i in range(len(cx_v)-1)], key=lambda x: x[0], reverse=True)
-        separators = sorted([ (cx_v[g[1]] + cx_v[g[1]+1])/2.0 for g in gaps[:3] ])
-        col_splits = [0] + separators + [img_width]
+        cx_v = np.sort(cx)
+        widest = np.argsort(-np.diff(cx_v), kind='stable')[:3]
+        separators = np.sort((cx_v[widest] + cx_v[widest + 1]) / 2.0)
+        col_splits = [0] + separators.tolist() + [img_width]
         
         # 3. Robust Row Identification using Quad-Column Consensus
-        by_y = sorted(good_bubbles, key=lambda b: b['cy'])
-        raw_rows = []
-        if by_y:
-            curr = [by_y[0]]
-            for b in by_y[1:]:
-                if abs(b['cy'] - curr[-1]['cy']) < img_height * 0.012: 
-                    curr.append(b)
-                else:
-                    raw_rows.append(curr)
-                    curr = [b]
-            raw_rows.append(curr)
+        order = np.argsort(cy, kind='stable')
+        cy_sorted = cy[order]
+        row_of = np.concatenate(([0], np.cumsum(np.diff(cy_sorted) >= img_height * 0.012)))
+        row_starts = np.flatnonzero(np.concatenate(([True], row_of[1:] != row_of[:-1])))
+        row_sizes = np.diff(np.append(row_starts, len(order)))
         
         # CRITICAL FILTER: An answer row MUST have bubbles across at least 3 distinct columns.
         # Header noise is typically localized (only Column 1 or 2).
-        answer_candidates = []
-        for r in raw_rows:
-            cols_hit = set()
-            for b in r:
-                for idx in range(4):
-                    if col_splits[idx] <= b['cx'] <= col_splits[idx+1]:
-                        cols_hit.add(idx)
-            # Answer rows are dense (12+ bubbles) and span multiple columns
-            if len(cols_hit) >= 3 and len(r) >= 10:
-                answer_candidates.append(r)
-        
-        if not answer_candidates: answer_candidates = raw_rows
+        cx_by_row = cx[order]
+        cols_hit = np.zeros((len(row_starts), 4), dtype=bool)
+        for idx in range(min(4, len(col_splits) - 1)):
+            in_col = (col_splits[idx] <= cx_by_row) & (cx_by_row <= col_splits[idx + 1])
+            cols_hit[:, idx] = np.bincount(row_of, weights=in_col, minlength=len(row_starts)) > 0
+        # Answer rows are dense (12+ bubbles) and span multiple columns
+        is_answer_row = (cols_hit.sum(axis=1) >= 3) & (row_sizes >= 10)
+        candidate_rows = np.flatnonzero(is_answer_row)
+        if len(candidate_rows) == 0: candidate_rows = np.arange(len(row_starts))
+        
+        # Rows are contiguous runs of cy_sorted, so each median is the middle of its run
+        starts, sizes = row_starts[candidate_rows], row_sizes[candidate_rows]
+        y_m = (cy_sorted[starts + (sizes - 1) // 2] + cy_sorted[starts + sizes // 2]) / 2.0
         
         # SELECT THE IMPROVED 10-ROW BLOCK
-        if len(answer_candidates) >= 10:
-            y_m = [np.median([c['cy'] for c in r]) for r in answer_candidates]
-            best_i, best_score = 0, float('inf')
-            for i in range(len(y_m) - 9):
-                intervals = [y_m[i+j+1] - y_m[i+j] for j in range(9)]
-                var = np.var(intervals)
-                quality = sum(sum(c.get('circularity', 0.5) for c in r) for r in answer_candidates[i:i+10])
-                # Bias towards the bottom and high quality
-                v_penalty = (img_height - y_m[i+9]) / img_height 
-                score = (var / (quality + 1.0)) + v_penalty * 0.1
-                if score < best_score:
-                    best_score = score
-                    best_i = i
-            y_anchors = y_m[best_i:best_i+10]
+        if len(y_m) >= 10:
+            intervals = np.lib.stride_tricks.sliding_window_view(np.diff(y_m), 9)
+            var = np.var(intervals, axis=1)
+            circ_by_row = good_bubbles['circularity'][order]
+            row_quality = np.bincount(row_of, weights=circ_by_row)[candidate_rows]
+            quality = np.lib.stride_tricks.sliding_window_view(row_quality, 10).sum(axis=1)
+            # Bias towards the bottom and high quality
+            v_penalty = (img_height - y_m[9:]) / img_height
+            score = (var / (quality + 1.0)) + v_penalty * 0.1
+            best_i = int(np.argmin(score))
+            y_anchors = y_m[best_i:best_i + 10]
         else:
-            y_anchors = sorted([np.median([c['cy'] for c in r]) for r in answer_candidates])
-
+            y_anchors = np.sort(y_m)
+        
         # Enforce 10 anchors via extrapolation
         if len(y_anchors) < 2: return answers
-        pitch = (y_anchors[-1] - y_anchors[0]) / (len(y_anchors)-1) if len(y_anchors) > 1 else img_height * 0.045
-        while len(y_anchors) < 10:
-            y_anchors.append(y_anchors[-1] + pitch)
+        pitch = (y_anchors[-1] - y_anchors[0]) / (len(y_anchors) - 1)
+        missing = 10 - len(y_anchors)
+        if missing > 0:
+            y_anchors = np.append(y_anchors, y_anchors[-1] + pitch * np.arange(1, missing + 1))
         
-        y_anchors = sorted(y_anchors[:10])
-        row_h = (y_anchors[-1] - y_anchors[0]) / 9.0 if len(y_anchors) > 1 else img_height * 0.04
+        y_anchors = np.sort(y_anchors[:10])
+        row_h = (y_anchors[-1] - y_anchors[0]) / 9.0
         
         # 4. Extract Answers per Question Slot
+        strength = good_bubbles['mark_strength']
+        column_slots = {}
         for col_idx in range(4):
             x_min, x_max = col_splits[col_idx], col_splits[col_idx+1]
-            col_bubbles = [b for b in good_bubbles if x_min <= b['cx'] <= x_max]
-            if not col_bubbles: continue
-            
-            c_cxs = sorted([b['cx'] for b in col_bubbles])
-            cx_tracks = []
-            if c_cxs:
-                curr_t = [c_cxs[0]]
-                for x in c_cxs[1:]:
-                    if abs(x - curr_t[-1]) < (x_max - x_min) * 0.08:
-                        curr_t.append(x)
-                    else:
-                        cx_tracks.append(curr_t)
-                        curr_t = [x]
-                cx_tracks.append(curr_t)
-            
-            active_tracks = cx_tracks[-4:] if len(cx_tracks) >= 4 else cx_tracks
-            slots = [np.median(t) for t in active_tracks]
+            in_col = (x_min <= cx) & (cx <= x_max)
+            if not in_col.any(): continue
+            col_cx, col_cy, col_strength = cx[in_col], cy[in_col], strength[in_col]
+            
+            # Slot tracks: runs of sorted x positions, keeping the rightmost four
+            c_cxs = np.sort(col_cx)
+            track_of = np.concatenate(([0], np.cumsum(np.diff(c_cxs) >= (x_max - x_min) * 0.08)))
+            track_ids = np.unique(track_of)[-4:]
+            slots = np.array([np.median(c_cxs[track_of == t]) for t in track_ids])
             slot_tol = (x_max - x_min) * 0.05
-
-            for row_idx, anchor_y in enumerate(y_anchors):
-                question_num = col_idx * 10 + row_idx + 1
-                q_bubbles = [b for b in col_bubbles if abs(b['cy'] - anchor_y) < row_h * 0.45]
-                
-                strengths = [0.05] * 4
-                for b in q_bubbles:
-                    track_idx = np.argmin([abs(b['cx'] - s) for s in slots])
-                    if abs(b['cx'] - slots[track_idx]) < slot_tol:
-                        if b['mark_strength'] > strengths[track_idx]:
-                            strengths[track_idx] = b['mark_strength']
-                
-                mx, avg = max(strengths), sum(strengths) / 4.0
-                if (mx - avg) > 0.07:
-                    answers[str(question_num)] = int(np.argmax(strengths)) + 1
+            column_slots[col_idx] = slots
+            
+            # Nearest slot per bubble, and which of the 10 rows each bubble sits in
+            slot_dist = np.abs(col_cx[:, None] - slots[None, :])
+            slot_of = np.argmin(slot_dist, axis=1)
+            in_slot = slot_dist[np.arange(len(col_cx)), slot_of] < slot_tol
+            bubble_idx, row_idx = np.nonzero(
+                (np.abs(col_cy[:, None] - y_anchors[None, :]) < row_h * 0.45) & in_slot[:, None]
+            )
+            
+            strengths = np.full((10, 4), 0.05)
+            np.maximum.at(strengths, (row_idx, slot_of[bubble_idx]), col_strength[bubble_idx])
+            found = np.zeros((10, 4), dtype=bool)
+            found[row_idx, slot_of[bubble_idx]] = True
+            
+            margins = strengths.max(axis=1) - strengths.sum(axis=1) / 4.0
+            for row in range(10):
+                question_num = col_idx * 10 + row + 1
+                # A slot with no detected bubble makes the margin unreliable
+                self.question_margins[str(question_num)] = float(margins[row])
+                if not found[row].all():
+                    self.incomplete_questions.add(str(question_num))
+                if margins[row] > MARK_MARGIN_THRESHOLD:
+                    answers[str(question_num)] = int(np.argmax(strengths[row])) + 1
+        
+        # Keep the inferred layout (normalized to the answer area) when the
+        # whole 4 x 10 x 4 grid was recovered, so it can serve as a template
+        if len(column_slots) == 4 and all(len(slots) == 4 for slots in column_slots.values()):
+            self.grid_layout = {
+                'y_anchors': [round(float(y) / img_height, 5) for y in y_anchors],
+                'slots': [[round(float(x) / img_width, 5) for x in column_slots[col]] for col in range(4)],
+                'bubble_w': round(float(np.median(good_bubbles['w'])) / img_width, 5),
+                'bubble_h': round(float(np.median(good_bubbles['h'])) / img_height, 5)
+            }
                     
         return answers
     
@@ -1121,8 +2635,837 @@ class EnhancedOMRProcessor:
         return rows
 
 
-# Initialize database
-db_manager = DatabaseManager(DB_FILE)
+# Database is opened lazily so that pool workers, which re-import this module
+# under the spawn/forkserver start methods, never open the grading database.
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+
+def get_db_manager():
+    """Get the process-wide database manager, initializing it on first use"""
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager(DB_FILE)
+    return _db_manager
+
+
+# ==================== GRADING HELPERS ====================
+
+def read_upload(file):
+    """Read an uploaded file into memory, enforcing MAX_UPLOAD_BYTES"""
+    data = file.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(
+            f"{file.filename or 'Image'} exceeds the {MAX_UPLOAD_BYTES} byte upload limit"
+        )
+    return data
+
+
+def persist_upload(data, filename=None):
+    """Keep a copy of an upload in IMAGE_DIR when SAVE_UPLOADS is enabled"""
+    if not SAVE_UPLOADS:
+        return None
+    
+    filename = filename or f"upload_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
+    path = os.path.join(IMAGE_DIR, filename)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def difference_hash(gray, size=PERCEPTUAL_HASH_SIZE):
+    """size*size-bit horizontal-gradient hash; survives re-encoding and resizing"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def upload_fingerprint(data, perceptual=PERCEPTUAL_DEDUP):
+    """(sha256 hex digest, difference hash or None) of an encoded upload"""
+    digest = hashlib.sha256(data).hexdigest()
+    if not perceptual:
+        return digest, None
+    # Full-size decode: reduced JPEG decoding would hash PNG copies differently
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    return digest, difference_hash(gray) if gray is not None else None
+
+
+class ResultCache:
+    """Thread-safe LRU of graded responses with a time-to-live
+    
+    Entries are keyed by (scope, digest), where the scope holds everything
+    besides the image that shapes the response (master key, form fields).
+    A lookup with a perceptual hash also accepts the closest entry of the
+    same scope within PERCEPTUAL_MAX_DISTANCE bits.
+    """
+    
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (scope, digest) -> (expires_at, phash, response)
+    
+    def _expire(self, now):
+        # Entries are in insertion-refresh order, but a hit does not extend
+        # the TTL, so scan for expired ones
+        for key in [k for k, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+    
+    def get(self, scope, digest, phash=None):
+        """A copy of the cached response, or None"""
+        if not self.max_entries:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            key = (scope, digest)
+            if key not in self._entries and phash is not None:
+                matches = [
+                    (bin(entry_phash ^ phash).count('1'), k)
+                    for k, (_, entry_phash, _) in self._entries.items()
+                    if k[0] == scope and entry_phash is not None
+                ]
+                distance, nearest = min(matches, default=(None, None), key=lambda m: m[0])
+                if nearest is not None and distance <= PERCEPTUAL_MAX_DISTANCE:
+                    key = nearest
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry[2])
+    
+    def put(self, scope, digest, response, phash=None):
+        """Cache a response, evicting the least recently used beyond max_entries"""
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[(scope, digest)] = (time.monotonic() + self.ttl, phash, dict(response))
+            self._entries.move_to_end((scope, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+result_cache = ResultCache()
+
+
+def grading_scope(active_master, params):
+    """Cache scope of a /grade_student request: the key's answers and every form field"""
+    # Answers are part of the scope because a correction keeps the key's id
+    return (active_master['id'], tuple(sorted(active_master['answers'].items())), params['profile'], params['student_id'],
+            params['student_name'], params['student_medium'])
+
+
+def replay_idempotent_result(idempotency_key):
+    """Rebuild the response of a result already saved under an idempotency key"""
+    saved = get_db_manager().get_result_by_idempotency_key(idempotency_key)
+    if saved is None:
+        return None
+    
+    results, details = grade_answers(saved['answers'], saved['master_answers'])
+    return {
+        "success": True,
+        "replayed": True,
+        "student_info": {
+            'student_id': saved['student_id'],
+            'name': saved['name'],
+            'subject': saved['subject'],
+            'medium': saved['medium'],
+            'grade_level': saved['grade_level']
+        },
+        "total_score": results['correct'],
+        "out_of": results['total'],
+        "correct": results['correct'],
+        "wrong": results['wrong'],
+        "unanswered": results['unanswered'],
+        "percentage": results['percentage'],
+        "details": details
+    }
+
+
+def previously_graded(active_master, params, fingerprint, idempotency_key=None):
+    """The response already given for this submission, or None
+    
+    A saved idempotency key wins; otherwise the result cache is consulted
+    with the upload's fingerprint.
+    """
+    if idempotency_key:
+        replayed = replay_idempotent_result(idempotency_key)
+        if replayed is not None:
+            logger.info(f"✓ Replayed result for idempotency key {idempotency_key}")
+            return replayed
+    
+    cached = result_cache.get(grading_scope(active_master, params), *fingerprint)
+    if cached is not None:
+        logger.info("✓ Returning cached result for a resubmitted sheet")
+        return dict(cached, cached=True)
+    return None
+
+
+def grade_answers(student_answers, master_answers, key=None):
+    """Compare detected answers against a master key
+    
+    `key` is the master key's 40-slot vector when it is already at hand
+    (the cached active key carries one); otherwise it is packed from
+    `master_answers`. Counting uses the same vectorized comparison as
+    rescoring; the per-question details are only built for the response.
+    """
+    if key is None:
+        key = unpack_answers(pack_answers(master_answers))
+    student = unpack_answers(pack_answers(student_answers))
+    correct, wrong, unanswered, total, percentage = score_answer_matrix(key, student[None, :])
+    
+    details = {}
+    for q, (master_ans, student_ans) in enumerate(zip(key.tolist(), student.tolist())):
+        if not master_ans:
+            continue
+        if not student_ans:
+            details[str(q + 1)] = {
+                "correct": master_ans,
+                "student": "Not answered",
+                "result": "unanswered"
+            }
+        else:
+            details[str(q + 1)] = {
+                "correct": master_ans,
+                "student": student_ans,
+                "result": "correct" if student_ans == master_ans else "wrong"
+            }
+    
+    results = {
+        'total': total,
+        'score': int(correct[0]),
+        'correct': int(correct[0]),
+        'wrong': int(wrong[0]),
+        'unanswered': int(unanswered[0]),
+        'percentage': percentage[0]
+    }
+    return results, details
+
+
+def item_analysis(key, matrix):
+    """Difficulty, discrimination and choice distribution of each question
+    
+    `key` is the 40-slot key vector and `matrix` the students' answers,
+    students x 40 (0 = unanswered in both). The point-biserial is
+    corrected: each item is correlated with the score on the other items, so
+    it does not correlate with itself. Statistics are None for questions the
+    key does not cover, and for a discrimination without any variance.
+    """
+    keyed = key > 0
+    correct = ((matrix == key) & keyed).astype(np.float64)
+    scores = correct.sum(axis=1)
+    students = len(matrix)
+    
+    if students:
+        p_values = correct.mean(axis=0)
+        rest = scores[:, None] - correct
+        covariance = (correct * rest).mean(axis=0) - p_values * rest.mean(axis=0)
+        spread = correct.std(axis=0) * rest.std(axis=0)
+        discrimination = np.divide(covariance, spread, out=np.full(40, np.nan), where=spread > 1e-12)
+    else:
+        p_values = discrimination = np.full(40, np.nan)
+    
+    # Choice counts per question in one bincount: question q's option o lands in bin 5 * q + o
+    options = np.where(matrix <= 4, matrix, 0).astype(np.int64)
+    choices = np.bincount((options + 5 * np.arange(40)).ravel(), minlength=200).reshape(40, 5)
+    
+    def stat(value, keyed_question):
+        return round(float(value), 4) if keyed_question and not np.isnan(value) else None
+    
+    items = []
+    for i in range(40):
+        items.append({
+            'question': i + 1,
+            'key': int(key[i]) or None,
+            'p_value': stat(p_values[i], keyed[i]),
+            'point_biserial': stat(discrimination[i], keyed[i]),
+            'choices': {'blank': int(choices[i, 0]), **{str(o): int(choices[i, o]) for o in range(1, 5)}}
+        })
+    
+    return {
+        'students': students,
+        'mean_score': round(float(scores.mean()), 2) if students else None,
+        'items': items
+    }
+
+
+_item_analysis_cache = {}  # master_key_id -> ((result count, packed key), analysis)
+_item_analysis_lock = threading.Lock()
+
+
+def get_item_analysis(master_key_id):
+    """Item analysis for a master key's results, reused until a result is
+    added or the key is corrected
+    
+    Returns (analysis, cached), or (None, False) for an unknown master key.
+    """
+    db_manager = get_db_manager()
+    signature = db_manager.get_analysis_signature(master_key_id)
+    if signature is None:
+        return None, False
+    with _item_analysis_lock:
+        cached = _item_analysis_cache.get(master_key_id)
+    if cached is not None and cached[0] == signature:
+        return cached[1], True
+    
+    cohort = db_manager.get_answer_cohort(master_key_id)
+    if cohort is None:
+        return None, False
+    analysis = item_analysis(*cohort)
+    # Read before the cohort, so a result saved in between only costs a recompute
+    with _item_analysis_lock:
+        _item_analysis_cache[master_key_id] = (signature, analysis)
+    return analysis, False
+
+
+def forget_item_analysis(master_key_id):
+    """Drop a cached item analysis"""
+    with _item_analysis_lock:
+        _item_analysis_cache.pop(master_key_id, None)
+
+
+_batch_pool = None
+
+_batch_pool_lock = threading.Lock()
+_column_pool = None
+_column_pool_lock = threading.Lock()
+
+
+def _init_batch_worker():
+    """Warm up a batch worker process"""
+    # One sheet per process already saturates the cores; OpenCV's own
+    # thread pool would only oversubscribe them.
+    cv2.setNumThreads(1)
+    cv2.GaussianBlur(np.zeros((32, 32), np.uint8), (5, 5), 0)
+
+
+def header_fields_needed(student_name, student_medium):
+    """Header fields that must come from OCR because the client did not send them"""
+    # Subject always comes from the master key
+    fields = []
+    if not student_medium:
+        fields.append('medium')
+    if not student_name:
+        fields.append('name')
+    return tuple(fields)
+
+
+def _process_sheet(data, profile=None, ocr_fields=HEADER_FIELDS, template=None, trace_memory=None,
+                   quality_gate=None):
+    """Run the OMR pipeline on one encoded sheet (executed inside a batch worker)
+    
+    Returns None when processing fails and {'rejected': quality} when the
+    quality gate turns the sheet away. Column threads stay off here: the pool
+    already runs one sheet per core.
+    """
+    processor = EnhancedOMRProcessor.from_bytes(data, profile=profile, ocr_fields=ocr_fields,
+                                                template=template, trace_memory=trace_memory,
+                                                parallel_columns=False, quality_gate=quality_gate)
+    if not processor.process():
+        return {'rejected': processor.quality} if processor.rejected else None
+    return sheet_summary(processor)
+
+
+def sheet_summary(processor):
+    """What grading needs from a processed sheet, as plain picklable data"""
+    return {
+        'answers': processor.answers,
+        'student_info': processor.student_info,
+        'profile': processor.profile,
+        'orientation': processor.orientation,
+        'template_used': processor.template_used,
+        'timings': processor.timings,
+        'peak_memory': processor.peak_memory
+    }
+
+
+def grade_student_sheet(active_master, sheet, student_id='', student_name='', student_medium='',
+                        idempotency_key=None):
+    """Grade one processed sheet, save it, and build the /grade_student response
+    
+    Blank student fields fall back to a generated ID and the OCR'd header.
+    Returns None when the result could not be saved.
+    """
+    subject = active_master['subject']
+    grade_level = active_master['grade_level']
+    student_answers = sheet['answers']
+    detected_info = sheet['student_info']
+    
+    # Generate student ID if not provided
+    if not student_id:
+        student_id = f"STU_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    
+    # Use detected or provided name
+    if not student_name:
+        student_name = detected_info.get('name', 'Unknown Student')
+    
+    # Use detected or provided medium
+    final_medium = student_medium or detected_info.get('medium', 'Unknown')
+    
+    logger.info(f"\nStudent ID: {student_id}")
+    logger.info(f"Name: {student_name}")
+    logger.info(f"Subject: {subject} (from master key)")
+    logger.info(f"Grade Level: {grade_level} (from master key)")
+    logger.info(f"Detected: {len(student_answers)}/40 answers")
+    
+    # Grade the answers using active master key
+    results, details = grade_answers(student_answers, active_master['answers'], active_master.get('key'))
+    correct, total, percentage = results['correct'], results['total'], results['percentage']
+    
+    # Save to database; the student row and the result commit together, so a
+    # failed student upsert fails the request instead of hiding the result
+    saved = get_db_manager().add_grading_results_batch([{
+        'student_id': student_id,
+        'name': student_name,
+        'subject': subject,
+        'medium': final_medium,
+        'grade_level': grade_level,
+        'exam_date': active_master['exam_date'],
+        'results': results,
+        'answers': student_answers,
+        'master_key_id': active_master['id'],
+        'idempotency_key': idempotency_key
+    }], durable=WRITE_DURABLE)
+    if not saved:
+        return None
+    
+    logger.info(f"✓ RESULT: {correct}/{total} ({percentage}%)")
+    
+    student_info = {
+        'student_id': student_id,
+        'name': student_name,
+        'subject': subject,
+        'medium': final_medium,
+        'grade_level': grade_level
+    }
+    
+    return {
+        "success": True,
+        "student_info": student_info,
+        "total_score": correct,
+        "out_of": total,
+        "correct": correct,
+        "wrong": results['wrong'],
+        "unanswered": results['unanswered'],
+        "percentage": percentage,
+        "processing_profile": sheet['profile'],
+        "orientation": sheet['orientation'],
+        "template_used": sheet['template_used'],
+        "details": details
+    }
+
+
+def quality_rejection(quality):
+    """Response body for a sheet turned away by the quality gate"""
+    return {
+        "error": QUALITY_REASONS[quality['reason']],
+        "reason": quality['reason'],
+        "quality": quality
+    }
+
+
+def record_timings(timings, peak_memory=None):
+    """Add one sheet's stage timings and peak memory (None when off) to stage_stats"""
+    if timings:
+        stage_stats.record(timings)
+    if peak_memory is not None:
+        stage_stats.record_memory(peak_memory)
+
+
+def timings_ms(timings):
+    """Stage timings rounded to milliseconds for a JSON response"""
+    return {stage: round(1000 * seconds, 2) for stage, seconds in (timings or {}).items()}
+
+
+def get_batch_pool():
+    """Get the shared process pool, starting its workers on first use"""
+    global _batch_pool
+    if _batch_pool is None:
+        with _batch_pool_lock:
+            if _batch_pool is None:
+                _batch_pool = ProcessPoolExecutor(
+                    max_workers=BATCH_WORKERS,
+                    initializer=_init_batch_worker
+                )
+                logger.info(f"✓ Batch pool started: {BATCH_WORKERS} workers")
+    return _batch_pool
+
+
+def discard_batch_pool(pool):
+    """Drop a pool broken by a crashed worker (segfault, OOM kill)
+    
+    The next get_batch_pool() starts a fresh one. Only `pool` itself is
+    dropped, so a replacement another thread already started survives.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is pool:
+            _batch_pool = None
+            logger.warning("A batch worker died; the batch pool will be restarted")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Stands in for the sheet of a batch worker that died
+WORKER_CRASHED = {'crashed': True}
+
+
+def map_batch_pool(fn, *iterables):
+    """get_batch_pool().map() that survives a crashed worker
+    
+    Results keep the input order. Items whose worker died, or that were
+    still waiting when it did, come back as WORKER_CRASHED, and the broken
+    pool is replaced for later calls.
+    """
+    pool = get_batch_pool()
+    futures = []
+    for args in zip(*iterables):
+        try:
+            futures.append(pool.submit(fn, *args))
+        except BrokenProcessPool:
+            futures.append(None)
+    
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result() if future else WORKER_CRASHED)
+        except BrokenProcessPool:
+            results.append(WORKER_CRASHED)
+    if any(result is WORKER_CRASHED for result in results):
+        discard_batch_pool(pool)
+    return results
+
+
+def get_column_pool():
+    """Get the shared thread pool for column tiles, starting it on first use"""
+    global _column_pool
+    if _column_pool is None:
+        with _column_pool_lock:
+            if _column_pool is None:
+                _column_pool = ThreadPoolExecutor(max_workers=COLUMN_TILES,
+                                                  thread_name_prefix='omr-column')
+    return _column_pool
+
+
+# ==================== JOB QUEUE ====================
+
+class JobQueue:
+    """Durable FIFO of grading jobs in SQLite, worked off by a bounded thread pool
+    
+    Worker threads only claim jobs and hand the sheet to the batch process
+    pool, so the CPU-bound work never competes for the GIL. Several server
+    processes can share one queue: a claimed job is leased to its process,
+    which renews the lease until the job finishes. A job whose lease lapsed
+    (its process crashed or was stopped) is queued again.
+    """
+    
+    FINISHED = ('done', 'failed')
+    
+    def __init__(self, db_path, workers=JOB_WORKERS, limit=JOB_QUEUE_LIMIT, lease_seconds=JOB_LEASE_SECONDS):
+        self.db_path = db_path
+        self.workers = workers
+        self.limit = limit
+        self.lease_seconds = lease_seconds
+        # Unique per queue instance; a restarted container often reuses the pid
+        self.pid = os.getpid()
+        self.worker_id = f"{socket.gethostname()}:{self.pid}:{uuid.uuid4().hex[:8]}"
+        self._cond = threading.Condition()
+        self._version = 0
+        self._threads = []
+        self._avg_seconds = 2.0
+        self.init_database()
+    
+    def _connect(self):
+        # Autocommit; writers that read first take the lock with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+    
+    def init_database(self):
+        """Create the jobs table if needed and requeue jobs whose lease lapsed"""
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT UNIQUE NOT NULL,
+                    status TEXT NOT NULL,
+                    params_json TEXT NOT NULL,
+                    image BLOB,
+                    result_json TEXT,
+                    http_status INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    claimed_by TEXT,
+                    lease_expires REAL
+                )
+            ''')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (('claimed_by', 'TEXT'), ('lease_expires', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, seq)')
+            self._requeue_expired(conn)
+        finally:
+            conn.close()
+    
+    def _requeue_expired(self, conn):
+        """Queue running jobs again whose claimant stopped renewing the lease"""
+        requeued = conn.execute('''
+            UPDATE jobs SET status = 'queued', started_at = NULL, claimed_by = NULL, lease_expires = NULL
+            WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)
+        ''', (time.time(),)).rowcount
+        if requeued:
+            logger.info(f"✓ Requeued {requeued} interrupted grading jobs")
+        return requeued
+    
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'omr-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name='omr-job-lease', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"✓ Job queue started: {self.workers} workers, limit {self.limit}")
+    
+    def _changed(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+    
+    def version(self):
+        """Counter bumped on every job state change; pass it to wait()"""
+        with self._cond:
+            return self._version
+    
+    def wait(self, version, timeout):
+        """Block until some job changed after `version`; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != version, timeout)
+    
+    def submit(self, params, data):
+        """Queue a sheet and return its job id, or raise QueueFullError"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+                (now - JOB_RETENTION_SECONDS,)
+            )
+            backlog = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            if backlog >= self.limit:
+                conn.execute('COMMIT')
+                raise QueueFullError(
+                    f"Grading queue is full ({backlog} jobs waiting)",
+                    retry_after=max(1, int(round(backlog * self._avg_seconds / max(1, self.workers))))
+                )
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, params_json, image, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(params), sqlite3.Binary(data), now)
+            )
+            conn.execute('COMMIT')
+        except QueueFullError:
+            raise
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        self._changed()
+        return job_id
+    
+    def get(self, job_id):
+        """Job status, with its queue position while queued and its result when finished"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT seq, status, result_json, http_status, created_at, started_at, finished_at
+                FROM jobs WHERE job_id = ?
+            ''', (job_id,)).fetchone()
+            if row is None:
+                return None
+            
+            seq, status, result_json, http_status, created_at, started_at, finished_at = row
+            job = {
+                'job_id': job_id,
+                'status': status,
+                'created_at': created_at,
+                'started_at': started_at,
+                'finished_at': finished_at
+            }
+            if status == 'queued':
+                job['position'] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND seq <= ?", (seq,)
+                ).fetchone()[0]
+            if status in self.FINISHED:
+                job['http_status'] = http_status
+                job['result'] = json.loads(result_json)
+            return job
+        finally:
+            conn.close()
+    
+    def _claim(self):
+        """Mark the oldest queued job running and return (job_id, params, image)"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Also picks up jobs of another process that died mid-job
+            self._requeue_expired(conn)
+            row = conn.execute(
+                "SELECT job_id, params_json, image FROM jobs WHERE status = 'queued' ORDER BY seq LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute('''
+                    UPDATE jobs SET status = 'running', started_at = ?, claimed_by = ?, lease_expires = ?
+                    WHERE job_id = ?
+                ''', (now, self.worker_id, now + self.lease_seconds, row[0]))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        
+        if row is None:
+            return None
+        self._changed()
+        return row[0], json.loads(row[1]), bytes(row[2])
+    
+    def _finish(self, job_id, status, result, http_status):
+        conn = self._connect()
+        try:
+            # The image is no longer needed once the job has an outcome
+            updated = conn.execute('''
+                UPDATE jobs SET status = ?, result_json = ?, http_status = ?, finished_at = ?, image = NULL,
+                    lease_expires = NULL
+                WHERE job_id = ? AND status = 'running' AND claimed_by = ?
+            ''', (status, json.dumps(result), http_status, time.time(), job_id, self.worker_id)).rowcount
+        finally:
+            conn.close()
+        if not updated:
+            logger.warning(f"Lease on grading job {job_id} lapsed; its result was discarded")
+        self._changed()
+    
+    def _heartbeat(self):
+        """Renew the leases of this process's running jobs"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE status = 'running' AND claimed_by = ?",
+                    (time.time() + self.lease_seconds, self.worker_id)
+                )
+            except Exception as e:
+                logger.error(f"Error renewing grading job leases: {e}")
+            finally:
+                conn.close()
+    
+    def _work(self):
+        while True:
+            version = self.version()
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming grading job: {e}")
+                job = None
+            if job is None:
+                # Also polls, for jobs queued by another server process
+                self.wait(version, JOB_POLL_SECONDS)
+                continue
+            
+            job_id, params, data = job
+            start = time.perf_counter()
+            try:
+                status, result, http_status = run_grading_job(params, data)
+            except Exception as e:
+                logger.error(f"Error in grading job {job_id}: {e}")
+                status, result, http_status = 'failed', {"error": str(e)}, 500
+            
+            elapsed = time.perf_counter() - start
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            try:
+                self._finish(job_id, status, result, http_status)
+            except Exception as e:
+                logger.error(f"Error saving grading job {job_id}: {e}")
+
+
+def run_grading_job(params, data):
+    """Grade one queued sheet; returns (status, response body, HTTP status)"""
+    active_master = params['master']
+    fingerprint = upload_fingerprint(data)
+    previous = previously_graded(active_master, params, fingerprint, params.get('idempotency_key'))
+    if previous is not None:
+        return 'done', previous, 200
+    
+    sheet, = map_batch_pool(
+        _process_sheet, [data], [params['profile']],
+        [header_fields_needed(params['student_name'], params['student_medium'])],
+        [active_master['layout']]
+    )
+    
+    if sheet is WORKER_CRASHED:
+        return 'failed', {"error": "The grading worker crashed; submit the sheet again"}, 500
+    if sheet is None:
+        return 'failed', {"error": "Image processing failed"}, 400
+    if 'rejected' in sheet:
+        return 'failed', quality_rejection(sheet['rejected']), 422
+    
+    record_timings(sheet['timings'], sheet['peak_memory'])
+    response = grade_student_sheet(
+        active_master, sheet, params['student_id'], params['student_name'], params['student_medium'],
+        idempotency_key=params.get('idempotency_key')
+    )
+    if response is None:
+        return 'failed', {"error": "Failed to save grading result"}, 500
+    result_cache.put(grading_scope(active_master, params), fingerprint[0], response, fingerprint[1])
+    return 'done', response, 200
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Get the process-wide job queue, starting its workers on first use
+    
+    A forked child (e.g. a gunicorn worker after --preload) gets its own
+    queue: the parent's worker threads do not survive the fork.
+    """
+    global _job_queue
+    if _job_queue is None or _job_queue.pid != os.getpid():
+        with _job_queue_lock:
+            if _job_queue is None or _job_queue.pid != os.getpid():
+                queue = JobQueue(JOBS_DB_FILE)
+                queue.start()
+                _job_queue = queue
+    return _job_queue
+
+
+def create_app():
+    """The Flask app, with the database open and the job queue running
+    
+    Jobs queued or leased before a restart resume right away instead of
+    waiting for the first /jobs request. Serve the app through this (see
+    wsgi.py); tools that only import main (grade_cli, the benchmark) do
+    not start job workers.
+    """
+    get_db_manager()
+    get_job_queue()
+    return app
 
 
 # ==================== FLASK ROUTES ====================
@@ -1141,7 +3484,8 @@ def test():
             "Enhanced Excel export with filters",
             "Statistics by subject/grade",
             "Master key management",
-            "Student history tracking"
+            "Student history tracking",
+            "Parallel batch grading"
         ]
     })
 
@@ -1153,9 +3497,7 @@ def upload_master():
         if 'image' not in request.files:
             return jsonify({"error": "No image provided"}), 400
         
-        file = request.files['image']
-        path = os.path.join(IMAGE_DIR, 'master_key.jpg')
-        file.save(path)
+        data = read_upload(request.files['image'])
         
         # Get metadata
         subject = request.form.get('subject', '').strip()
@@ -1164,16 +3506,37 @@ def upload_master():
         
         exam_date = request.form.get('exam_date', datetime.now().strftime('%Y-%m-%d'))
         grade_level = request.form.get('grade_level', 'General').strip()
+        profile = request.form.get('profile', MASTER_PROFILE)
+        if profile not in PROCESSING_PROFILES:
+            return jsonify({"error": f"Unknown processing profile: {profile}"}), 400
         
         logger.info("="*80)
         logger.info("PROCESSING MASTER ANSWER KEY")
         logger.info(f"Subject: {subject} | Grade: {grade_level}")
         logger.info("="*80)
         
-        processor = EnhancedOMRProcessor(path)
-        if not processor.process():
+        persist_upload(data, 'master_key.jpg')
+        
+        # The header is not needed for a master key, so skip OCR entirely
+        # Not traced: other request threads would count towards the peak
+        processor = EnhancedOMRProcessor.from_bytes(data, profile=profile, ocr_fields=(), trace_memory=False)
+        processed = processor.process()
+        record_timings(processor.timings)
+        if not processed:
+            if processor.rejected:
+                return jsonify(quality_rejection(processor.quality)), 422
             return jsonify({"error": "Image processing failed"}), 400
         
+        # Every student would be graded against a partial key, so refuse it
+        unreliable = processor.unreliable_questions()
+        if unreliable:
+            logger.warning(f"Master key rejected: questions {', '.join(unreliable)} not read with confidence")
+            return jsonify({
+                "error": f"Could not read every answer on the master key with confidence "
+                         f"(questions {', '.join(unreliable)}). Rescan it.",
+                "unreliable_questions": unreliable
+            }), 400
+        
         # Save to file (for backwards compatibility)
         with open(MASTER_DATA_FILE, 'w') as f:
             json.dump(processor.answers, f, indent=2)
@@ -1188,7 +3551,9 @@ def upload_master():
             json.dump(metadata, f, indent=2)
         
         # Save to database
-        master_key_id = db_manager.add_master_key(subject, exam_date, grade_level, processor.answers)
+        master_key_id = get_db_manager().add_master_key(
+            subject, exam_date, grade_level, processor.answers, layout=processor.grid_layout
+        )
         
         if not master_key_id:
             return jsonify({"error": "Failed to save master key to database"}), 500
@@ -1204,9 +3569,13 @@ def upload_master():
             "subject": subject,
             "grade_level": grade_level,
             "exam_date": exam_date,
-            "master_key_id": master_key_id
+            "master_key_id": master_key_id,
+            "layout_captured": processor.grid_layout is not None
         })
     
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    
     except Exception as e:
         logger.error(f"Error in upload_master: {e}")
         import traceback
@@ -1214,11 +3583,33 @@ def upload_master():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/stage_timings', methods=['GET'])
+def get_stage_timings():
+    """Per-stage processing times and peak memory aggregated since startup (or the last reset)"""
+    try:
+        stats = stage_stats.snapshot()
+        memory = stage_stats.memory_snapshot()
+        if request.args.get('reset', '').strip().lower() in ('1', 'true', 'yes'):
+            stage_stats.reset()
+        
+        return jsonify({
+            "success": True,
+            "enabled": STAGE_TIMINGS,
+            "stages": stats,
+            "memory_traced": TRACE_MEMORY,
+            "peak_memory": memory
+        })
+    
+    except Exception as e:
+        logger.error(f"Error fetching stage timings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/get_master_metadata', methods=['GET'])
 def get_master_metadata():
     """Get current master key metadata"""
     try:
-        active_master = db_manager.get_active_master_key()
+        active_master = get_db_manager().get_active_master_key()
         
         if not active_master:
             return jsonify({
@@ -1238,12 +3629,63 @@ def get_master_metadata():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/master_keys/<int:master_key_id>/answers', methods=['PATCH'])
+def correct_master_key(master_key_id):
+    """Correct answers in a master key and rescore every result graded against it
+    
+    Body: {"answers": {"12": 3, "30": null}}; null drops a question from the key.
+    """
+    try:
+        corrections = (request.get_json(silent=True) or {}).get('answers')
+        if not isinstance(corrections, dict) or not corrections:
+            return jsonify({"error": "answers must be a non-empty object of question: option"}), 400
+        for q, option in corrections.items():
+            if not (str(q).isdigit() and 1 <= int(q) <= 40):
+                return jsonify({"error": f"Invalid question number: {q}"}), 400
+            # JSON true and 1.0 compare equal to 1; only integers are options
+            if option is not None and (type(option) is not int or option not in (1, 2, 3, 4)):
+                return jsonify({"error": f"Invalid option for question {q}: {option}"}), 400
+        
+        db_manager = get_db_manager()
+        rescored = db_manager.rescore_results(master_key_id, corrections)
+        if rescored is None:
+            return jsonify({"error": "Unknown master key or rescoring failed"}), 404
+        
+        # Cached responses were graded against the old key
+        result_cache.clear()
+        forget_item_analysis(master_key_id)
+        active_master = db_manager.get_active_master_key()
+        if active_master and active_master['id'] == master_key_id:
+            with open(MASTER_DATA_FILE, 'w') as f:
+                json.dump(active_master['answers'], f, indent=2)
+        
+        return jsonify({"success": True, "master_key_id": master_key_id, "rescored": rescored})
+    
+    except Exception as e:
+        logger.error(f"Error correcting master key: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/master_keys/<int:master_key_id>/rescore', methods=['POST'])
+def rescore_master_key(master_key_id):
+    """Recompute stored scores against the master key as it is now"""
+    try:
+        rescored = get_db_manager().rescore_results(master_key_id)
+        if rescored is None:
+            return jsonify({"error": "Unknown master key or rescoring failed"}), 404
+        return jsonify({"success": True, "master_key_id": master_key_id, "rescored": rescored})
+    
+    except Exception as e:
+        logger.error(f"Error rescoring master key {master_key_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/grade_student', methods=['POST'])
 def grade_student():
     """Grade student with subject inherited from master key"""
     try:
         # Check if master key exists
-        active_master = db_manager.get_active_master_key()
+        active_master = get_db_manager().get_active_master_key()
         
         if not active_master:
             return jsonify({"error": "No active master key! Please upload master key first."}), 400
@@ -1251,19 +3693,30 @@ def grade_student():
         if 'image' not in request.files:
             return jsonify({"error": "No image provided"}), 400
         
-        file = request.files['image']
-        path = os.path.join(IMAGE_DIR, 'student.jpg')
-        file.save(path)
+        data = read_upload(request.files['image'])
+        persist_upload(data)
         
         # Get student information
         student_id = request.form.get('student_id', '').strip()
         student_name = request.form.get('student_name', '').strip()
         student_medium = request.form.get('student_medium', '').strip()
+        profile = request.form.get('profile', DEFAULT_PROFILE)
+        if profile not in PROCESSING_PROFILES:
+            return jsonify({"error": f"Unknown processing profile: {profile}"}), 400
+        debug = request.form.get('debug', '').strip().lower() in ('1', 'true', 'yes')
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip() or None
+        
+        # A resubmitted photo (e.g. after a timeout) is answered without regrading
+        params = {'student_id': student_id, 'student_name': student_name,
+                  'student_medium': student_medium, 'profile': profile}
+        fingerprint = upload_fingerprint(data)
+        previous = previously_graded(active_master, params, fingerprint, idempotency_key)
+        if previous is not None:
+            return jsonify(previous)
         
         # Subject and grade level inherited from master key
         subject = active_master['subject']
         grade_level = active_master['grade_level']
-        exam_date = active_master['exam_date']
         
         logger.info("="*80)
         logger.info("GRADING STUDENT SHEET")
@@ -1271,114 +3724,276 @@ def grade_student():
         logger.info("="*80)
         
         # Process image
-        processor = EnhancedOMRProcessor(path)
-        if not processor.process():
+        processor = EnhancedOMRProcessor.from_bytes(
+            data, profile=profile,
+            ocr_fields=header_fields_needed(student_name, student_medium),
+            template=active_master['layout'],
+            # Debug requests are always timed, even with timing off globally
+            timings=True if debug else None,
+            # Not traced: other request threads would count towards the peak
+            trace_memory=False
+        )
+        processed = processor.process()
+        record_timings(processor.timings)
+        if not processed:
+            if processor.rejected:
+                return jsonify(quality_rejection(processor.quality)), 422
             return jsonify({"error": "Image processing failed"}), 400
         
-        student_answers = processor.answers
-        detected_info = processor.student_info
+        response = grade_student_sheet(
+            active_master, sheet_summary(processor), student_id, student_name, student_medium,
+            idempotency_key=idempotency_key
+        )
+        if response is None:
+            return jsonify({"error": "Failed to save grading result"}), 500
+        result_cache.put(grading_scope(active_master, params), fingerprint[0], response, fingerprint[1])
+        if debug:
+            response["timings_ms"] = timings_ms(processor.timings)
+        
+        return jsonify(response)
+    
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    
+    except Exception as e:
+        logger.error(f"Error in grade_student: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a student sheet for grading and return at once
+    
+    Takes the same form fields as /grade_student. The result (the
+    /grade_student response) is collected from /jobs/<id> or streamed from
+    /jobs/<id>/events.
+    """
+    try:
+        active_master = get_db_manager().get_active_master_key()
         
-        # Generate student ID if not provided
-        if not student_id:
-            student_id = f"STU_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        if not active_master:
+            return jsonify({"error": "No active master key! Please upload master key first."}), 400
+        
+        if 'image' not in request.files:
+            return jsonify({"error": "No image provided"}), 400
+        
+        profile = request.form.get('profile', DEFAULT_PROFILE)
+        if profile not in PROCESSING_PROFILES:
+            return jsonify({"error": f"Unknown processing profile: {profile}"}), 400
+        
+        data = read_upload(request.files['image'])
+        params = {
+            'student_id': request.form.get('student_id', '').strip(),
+            'student_name': request.form.get('student_name', '').strip(),
+            'student_medium': request.form.get('student_medium', '').strip(),
+            'profile': profile,
+            'idempotency_key': request.headers.get('Idempotency-Key', '').strip() or None,
+            # Graded against the key that was active at submission (params are
+            # stored as JSON, so without the vector; it is rebuilt from answers)
+            'master': {name: value for name, value in active_master.items() if name != 'key'}
+        }
+        job_id = get_job_queue().submit(params, data)
+        persist_upload(data)
+        
+        response = jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events"
+        })
+        response.headers['Location'] = f"/jobs/{job_id}"
+        return response, 202
+    
+    except QueueFullError as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    
+    except Exception as e:
+        logger.error(f"Error in submit_job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a grading job"""
+    try:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job"}), 404
+        return jsonify(job)
+    
+    except Exception as e:
+        logger.error(f"Error fetching job {job_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    """Server-sent events: one event per status change until the job finishes"""
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    
+    def events():
+        last = None
+        while True:
+            version = queue.version()
+            job = queue.get(job_id)
+            if job is None:
+                # Expired while we were watching
+                yield f"event: failed\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+                return
+            
+            state = (job['status'], job.get('position'))
+            if state != last:
+                last = state
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            if job['status'] in JobQueue.FINISHED:
+                return
+            if not queue.wait(version, JOB_EVENT_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/grade_batch', methods=['POST'])
+def grade_batch():
+    """Grade many student sheets in one request across the worker pool"""
+    try:
+        active_master = get_db_manager().get_active_master_key()
         
-        # Use detected or provided name
-        if not student_name:
-            student_name = detected_info.get('name', 'Unknown Student')
+        if not active_master:
+            return jsonify({"error": "No active master key! Please upload master key first."}), 400
         
-        # Use detected or provided medium
-        final_medium = student_medium or detected_info.get('medium', 'Unknown')
+        files = request.files.getlist('images')
+        if not files:
+            return jsonify({"error": "No images provided"}), 400
         
-        logger.info(f"\nStudent ID: {student_id}")
-        logger.info(f"Name: {student_name}")
-        logger.info(f"Subject: {subject} (from master key)")
-        logger.info(f"Grade Level: {grade_level} (from master key)")
-        logger.info(f"Detected: {len(student_answers)}/40 answers")
+        # Optional per-sheet fields, matched to images by position
+        student_ids = request.form.getlist('student_ids')
+        student_names = request.form.getlist('student_names')
+        student_mediums = request.form.getlist('student_mediums')
+        profile = request.form.get('profile', DEFAULT_PROFILE)
+        if profile not in PROCESSING_PROFILES:
+            return jsonify({"error": f"Unknown processing profile: {profile}"}), 400
         
-        # Grade the answers using active master key
-        master_answers = active_master['answers']
+        subject = active_master['subject']
+        grade_level = active_master['grade_level']
+        exam_date = active_master['exam_date']
         
-        correct = wrong = unanswered = 0
-        details = {}
+        logger.info("="*80)
+        logger.info(f"GRADING BATCH OF {len(files)} SHEETS")
+        logger.info(f"Subject: {subject} | Grade: {grade_level}")
+        logger.info("="*80)
         
-        for q in range(1, 41):
-            qs = str(q)
-            master_ans = master_answers.get(qs)
-            student_ans = student_answers.get(qs)
-            
-            if master_ans is None:
-                continue
-            
-            if student_ans is None:
-                unanswered += 1
-                details[qs] = {
-                    "correct": master_ans,
-                    "student": "Not answered",
-                    "result": "unanswered"
-                }
-            elif student_ans == master_ans:
-                correct += 1
-                details[qs] = {
-                    "correct": master_ans,
-                    "student": student_ans,
-                    "result": "correct"
-                }
-            else:
-                wrong += 1
-                details[qs] = {
-                    "correct": master_ans,
-                    "student": student_ans,
-                    "result": "wrong"
-                }
+        uploads = [read_upload(file) for file in files]
+        for data in uploads:
+            persist_upload(data)
         
-        total = len(master_answers)
-        percentage = round((correct / total) * 100, 2) if total > 0 else 0
+        def field(values, idx):
+            return values[idx].strip() if idx < len(values) else ''
         
-        results = {
-            'total': total,
-            'score': correct,
-            'correct': correct,
-            'wrong': wrong,
-            'unanswered': unanswered,
-            'percentage': percentage
-        }
+        ocr_fields = [
+            header_fields_needed(field(student_names, idx), field(student_mediums, idx))
+            for idx in range(len(uploads))
+        ]
         
-        # Save to database
-        db_manager.add_student(student_id, student_name, subject, final_medium, grade_level)
-        db_manager.add_grading_result(
-            student_id,
-            subject,
-            grade_level,
-            exam_date,
-            results,
-            student_answers,
-            active_master['id']
+        # In input order regardless of completion order
+        processed = map_batch_pool(
+            _process_sheet, uploads, [profile] * len(uploads), ocr_fields,
+            [active_master['layout']] * len(uploads)
         )
         
-        logger.info(f"✓ RESULT: {correct}/{total} ({percentage}%)")
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        sheet_results = []
+        entries = []
+        
+        for idx, (file, sheet) in enumerate(zip(files, processed)):
+            if sheet is None or sheet is WORKER_CRASHED or 'rejected' in sheet:
+                failure = {
+                    "index": idx,
+                    "filename": file.filename,
+                    "success": False,
+                    "error": "Image processing failed"
+                }
+                if sheet is WORKER_CRASHED:
+                    failure["error"] = "The grading worker crashed; submit the sheet again"
+                elif sheet:
+                    failure.update(quality_rejection(sheet['rejected']))
+                sheet_results.append(failure)
+                continue
+            
+            record_timings(sheet['timings'], sheet['peak_memory'])
+            student_answers = sheet['answers']
+            detected_info = sheet['student_info']
+            
+            student_id = field(student_ids, idx) or f"STU_{timestamp}_{idx + 1:03d}"
+            student_name = field(student_names, idx) or detected_info.get('name', 'Unknown Student')
+            final_medium = field(student_mediums, idx) or detected_info.get('medium', 'Unknown')
+            
+            results, details = grade_answers(student_answers, active_master['answers'], active_master['key'])
+            
+            entries.append({
+                'student_id': student_id,
+                'name': student_name,
+                'subject': subject,
+                'medium': final_medium,
+                'grade_level': grade_level,
+                'exam_date': exam_date,
+                'results': results,
+                'answers': student_answers,
+                'master_key_id': active_master['id']
+            })
+            
+            sheet_results.append({
+                "index": idx,
+                "filename": file.filename,
+                "success": True,
+                "student_info": {
+                    'student_id': student_id,
+                    'name': student_name,
+                    'subject': subject,
+                    'medium': final_medium,
+                    'grade_level': grade_level
+                },
+                "total_score": results['correct'],
+                "out_of": results['total'],
+                "correct": results['correct'],
+                "wrong": results['wrong'],
+                "unanswered": results['unanswered'],
+                "percentage": results['percentage'],
+                "processing_profile": sheet['profile'],
+                "orientation": sheet['orientation'],
+                "template_used": sheet['template_used'],
+                "details": details
+            })
         
-        student_info = {
-            'student_id': student_id,
-            'name': student_name,
-            'subject': subject,
-            'medium': final_medium,
-            'grade_level': grade_level
-        }
+        if entries and not get_db_manager().add_grading_results_batch(entries):
+            return jsonify({"error": "Failed to save batch results to database"}), 500
+        
+        logger.info(f"✓ BATCH RESULT: {len(entries)}/{len(files)} sheets graded")
         
         return jsonify({
             "success": True,
-            "student_info": student_info,
-            "total_score": correct,
-            "out_of": total,
-            "correct": correct,
-            "wrong": wrong,
-            "unanswered": unanswered,
-            "percentage": percentage,
-            "details": details
+            "total_sheets": len(files),
+            "graded": len(entries),
+            "failed": len(files) - len(entries),
+            "results": sheet_results
         })
     
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    
     except Exception as e:
-        logger.error(f"Error in grade_student: {e}")
+        logger.error(f"Error in grade_batch: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -1388,7 +4003,7 @@ def grade_student():
 def get_filters():
     """Get available filter options"""
     try:
-        filters = db_manager.get_available_filters()
+        filters = get_db_manager().get_available_filters()
         
         return jsonify({
             "success": True,
@@ -1404,7 +4019,7 @@ def get_filters():
 def get_results_grouped():
     """Get results grouped by subject and grade level"""
     try:
-        grouped = db_manager.get_results_by_subject_and_grade()
+        grouped = get_db_manager().get_results_by_subject_and_grade()
         
         return jsonify({
             "success": True,
@@ -1425,7 +4040,7 @@ def export_excel():
         exam_date = request.args.get('exam_date')
         grade = request.args.get('grade')
         
-        results = db_manager.get_all_results(subject, grade_level, exam_date, grade)
+        results = get_db_manager().get_all_results(subject, grade_level, exam_date, grade)
         
         if not results:
             return jsonify({"error": "No results found matching filters"}), 404
@@ -1484,7 +4099,7 @@ def get_all_results():
         exam_date = request.args.get('exam_date')
         grade = request.args.get('grade')
         
-        results = db_manager.get_all_results(subject, grade_level, exam_date, grade)
+        results = get_db_manager().get_all_results(subject, grade_level, exam_date, grade)
         
         formatted_results = []
         for r in results:
@@ -1522,7 +4137,7 @@ def get_all_results():
 def get_student_history(student_id):
     """Get grading history for a student"""
     try:
-        history = db_manager.get_student_history(student_id)
+        history = get_db_manager().get_student_history(student_id)
         
         formatted_history = []
         for h in history:
@@ -1548,6 +4163,36 @@ def get_student_history(student_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/item_analysis', methods=['GET'])
+def get_item_analysis_route():
+    """Per-question p-value, point-biserial and choice distribution for an exam
+    
+    Query: master_key_id (default: the active master key).
+    """
+    try:
+        master_key_id = request.args.get('master_key_id', type=int)
+        if master_key_id is None:
+            active_master = get_db_manager().get_active_master_key()
+            if not active_master:
+                return jsonify({"error": "No active master key"}), 404
+            master_key_id = active_master['id']
+        
+        analysis, cached = get_item_analysis(master_key_id)
+        if analysis is None:
+            return jsonify({"error": "Unknown master key"}), 404
+        
+        return jsonify({
+            "success": True,
+            "master_key_id": master_key_id,
+            "cached": cached,
+            **analysis
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in item analysis: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/get_statistics', methods=['GET'])
 def get_statistics():
     """Get statistics with optional filters"""
@@ -1555,7 +4200,7 @@ def get_statistics():
         subject = request.args.get('subject')
         grade_level = request.args.get('grade_level')
         
-        stats = db_manager.get_statistics(subject, grade_level)
+        stats = get_db_manager().get_statistics(subject, grade_level)
         
         return jsonify({
             "success": True,
@@ -1581,6 +4226,12 @@ if __name__ == '__main__':
     logger.info("  ✓ Student history tracking")
     logger.info("  ✓ Robust OMR detection")
     logger.info("  ✓ Multi-language OCR support")
+    logger.info(f"  ✓ Parallel batch grading ({BATCH_WORKERS} workers)")
+    logger.info(f"  ✓ Queued grading jobs ({JOB_WORKERS} workers)")
     logger.info("="*80)
     
+    get_db_manager()
+    # Under the reloader only the child process serves requests and runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""_score_candidates must agree with _is_marked_advanced on every candidate"""
+import numpy as np
+import pytest
+
+from main import EnhancedOMRProcessor
+
+
+def _processor(gray):
+    return EnhancedOMRProcessor(image=np.dstack([gray] * 3), ocr_fields=(), timings=False)
+
+
+def _images(rng, height, width):
+    """A noisy page with dark blobs, and a binary image that mostly follows it"""
+    gray = rng.integers(120, 256, size=(height, width)).astype(np.uint8)
+    for _ in range(20):
+        y, x = rng.integers(0, height), rng.integers(0, width)
+        r = int(rng.integers(2, 12))
+        gray[max(0, y - r):y + r, max(0, x - r):x + r] = rng.integers(0, 200)
+    binary = np.where(gray < rng.integers(100, 200), 255, 0).astype(np.uint8)
+    flips = rng.random(gray.shape) < 0.05
+    binary[flips] = 255 - binary[flips]
+    return gray, binary
+
+
+def _candidates(rng, height, width, n):
+    """Boxes anywhere on the page, some running off its right or bottom edge
+    or too small to score
+
+    Origins stay on the page as cv2.boundingRect's do; the padded ROI of a
+    box near the top or left edge is still clipped.
+    """
+    ws = rng.integers(2, 40, size=n)
+    hs = rng.integers(2, 40, size=n)
+    xs = rng.integers(0, width, size=n)
+    ys = rng.integers(0, height, size=n)
+    # Bubbles flush against each border
+    xs[:4] = [0, width - ws[1], 0, width - ws[3]]
+    ys[:4] = [0, 0, height - hs[2], height - hs[3]]
+    return xs, ys, ws, hs
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_matches_per_bubble_scoring(seed):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(60, 200, size=2)
+    gray, binary = _images(rng, height, width)
+    xs, ys, ws, hs = _candidates(rng, height, width, 300)
+    processor = _processor(gray)
+
+    marked, strengths = processor._score_candidates(gray, binary, xs, ys, ws, hs)
+
+    for i in range(len(xs)):
+        circle = {'x': int(xs[i]), 'y': int(ys[i]), 'w': int(ws[i]), 'h': int(hs[i])}
+        expected_marked, expected_strength = processor._is_marked_advanced(gray, binary, circle)
+        assert marked[i] == expected_marked, circle
+        assert strengths[i] == pytest.approx(expected_strength, abs=1e-9), circle
+
+
+def test_small_and_off_page_candidates_score_zero():
+    rng = np.random.default_rng(0)
+    gray, binary = _images(rng, 80, 80)
+    processor = _processor(gray)
+    # radius < 3, then entirely right of and below the page
+    xs, ys = np.array([10, 90, 10]), np.array([10, 10, 95])
+    ws, hs = np.array([8, 20, 20]), np.array([9, 20, 20])
+
+    marked, strengths = processor._score_candidates(gray, binary, xs, ys, ws, hs)
+
+    assert not marked.any()
+    assert (strengths == 0.0).all()
+
+
+def test_no_candidates():
+    gray = np.full((50, 50), 255, dtype=np.uint8)
+    empty = np.array([], dtype=np.int64)
+    marked, strengths = _processor(gray)._score_candidates(gray, gray, empty, empty, empty, empty)
+    assert marked.shape == strengths.shape == (0,)
@@ -0,0 +1,8 @@
+"""WSGI entry point: gunicorn -w 2 wsgi:app
+
+Builds the app through create_app(), so the job queue starts (and jobs
+from before a restart resume) as soon as each worker process loads.
+"""
+from main import create_app
+
+app = create_app()
@@ -1,19 +1,20 @@
 import cv2, sys, json, numpy as np
-from backend.main import EnhancedOMRProcessor
+from backend.main import EnhancedOMRProcessor, BUBBLE_MIN_AREA, BUBBLE_MAX_AREA, ANSWER_THRESHOLD_BLOCK
 
 image_path = sys.argv[1]
 watch_qs = list(map(int, sys.argv[2].split(','))) if len(sys.argv) > 2 else list(range(1,11))
 
-proc = EnhancedOMRProcessor(image_path)
+# Lean mode would drop the warped sheet this script inspects
+proc = EnhancedOMRProcessor(image_path, lean=False)
 proc.process()
 
 all_circles = []
 height, width = proc.warped.shape[:2]
 answer_area = proc.warped[int(height * 0.20):int(height * 0.97), :]
 img_height, img_width = answer_area.shape[:2]
-gray = cv2.cvtColor(answer_area, cv2.COLOR_BGR2GRAY)
+gray = answer_area if answer_area.ndim == 2 else cv2.cvtColor(answer_area, cv2.COLOR_BGR2GRAY)
 denoised = cv2.fastNlMeansDenoising(gray)
-adaptive = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 3)
+adaptive = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, ANSWER_THRESHOLD_BLOCK, 3)
 _, otsu = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 combined = cv2.bitwise_or(adaptive, otsu)
 kernel = np.ones((2,2), np.uint8)
@@ -21,7 +22,7 @@ cleaned = cv2.morphologyEx(cv2.morphologyEx(combined, cv2.MORPH_OPEN, kernel), c
 contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 for cnt in contours:
     area = cv2.contourArea(cnt)
-    if area < 80 or area > 5000: continue
+    if area < BUBBLE_MIN_AREA or area > BUBBLE_MAX_AREA: continue
     x, y, w, h = cv2.boundingRect(cnt)
     ar = w/float(h) if h else 0
     if ar < 0.5 or ar > 2.0: continue